@@ -0,0 +1,44 @@
+"""Store memories.tags as JSON
+
+Revision ID: 3b7e52c9a1d4
+Revises: f8d1d841da36
+Create Date: 2026-10-14 05:02:11.418203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7e52c9a1d4'
+down_revision: Union[str, Sequence[str], None] = 'f8d1d841da36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing values were written with json.dumps, so they parse as-is;
+    # batch mode recreates the table on SQLite, Postgres casts in place
+    with op.batch_alter_table('memories') as batch_op:
+        batch_op.alter_column(
+            'tags',
+            existing_type=sa.Text(),
+            type_=sa.JSON(),
+            existing_nullable=True,
+            postgresql_using='tags::json'
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('memories') as batch_op:
+        batch_op.alter_column(
+            'tags',
+            existing_type=sa.JSON(),
+            type_=sa.Text(),
+            existing_nullable=True,
+            postgresql_using='tags::text'
+        )
@@ -0,0 +1,110 @@
+"""Store UUID primary and foreign keys in 16 bytes
+
+Revision ID: 5e2d8b3f7a10
+Revises: 9c4a1f6e2b87
+Create Date: 2026-10-14 09:48:05.221634
+
+"""
+from typing import Sequence, Union
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2d8b3f7a10'
+down_revision: Union[str, Sequence[str], None] = '9c4a1f6e2b87'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Every UUID key column, and the foreign keys between them
+UUID_COLUMNS = {
+    'users': ['id'],
+    'interactions': ['id', 'user_id'],
+    'memories': ['id', 'user_id', 'interaction_id'],
+}
+FOREIGN_KEYS = [
+    ('interactions', 'user_id', 'users'),
+    ('memories', 'user_id', 'users'),
+    ('memories', 'interaction_id', 'interactions'),
+]
+
+
+def _to_bytes(value):
+    """Canonical UUID text -> 16 raw bytes; anything else is kept as UTF-8"""
+    try:
+        return uuid.UUID(value).bytes
+    except (TypeError, ValueError):
+        return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def _to_text(value):
+    """16 raw bytes -> canonical UUID text"""
+    if isinstance(value, bytes):
+        return str(uuid.UUID(bytes=value)) if len(value) == 16 else value.decode('utf-8')
+    return value
+
+
+def _rewrite_values(convert) -> None:
+    """Convert every stored key value in place, row by row"""
+    bind = op.get_bind()
+    for table, columns in UUID_COLUMNS.items():
+        rows = bind.execute(sa.text(f"SELECT rowid, {', '.join(columns)} FROM {table}")).fetchall()
+        assignments = ', '.join(f"{column} = :{column}" for column in columns)
+        update = sa.text(f"UPDATE {table} SET {assignments} WHERE rowid = :rowid")
+        for row in rows:
+            params = {column: convert(value) for column, value in zip(columns, row[1:])}
+            bind.execute(update, {**params, 'rowid': row[0]})
+
+
+def _alter_types(type_) -> None:
+    """Change the declared type of every key column (recreates tables on SQLite)"""
+    for table, columns in UUID_COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.String(), type_=type_)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        # Native uuid type; foreign keys must be dropped while the types differ
+        for table, column, _ in FOREIGN_KEYS:
+            op.drop_constraint(f'{table}_{column}_fkey', table, type_='foreignkey')
+        for table, columns in UUID_COLUMNS.items():
+            for column in columns:
+                op.alter_column(
+                    table, column,
+                    existing_type=sa.String(),
+                    type_=postgresql.UUID(as_uuid=False),
+                    postgresql_using=f'{column}::uuid'
+                )
+        for table, column, referent in FOREIGN_KEYS:
+            op.create_foreign_key(f'{table}_{column}_fkey', table, referent, [column], ['id'])
+        return
+
+    _rewrite_values(_to_bytes)
+    _alter_types(sa.LargeBinary(16))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, column, _ in FOREIGN_KEYS:
+            op.drop_constraint(f'{table}_{column}_fkey', table, type_='foreignkey')
+        for table, columns in UUID_COLUMNS.items():
+            for column in columns:
+                op.alter_column(
+                    table, column,
+                    existing_type=postgresql.UUID(as_uuid=False),
+                    type_=sa.String(),
+                    postgresql_using=f'{column}::text'
+                )
+        for table, column, referent in FOREIGN_KEYS:
+            op.create_foreign_key(f'{table}_{column}_fkey', table, referent, [column], ['id'])
+        return
+
+    _rewrite_values(_to_text)
+    _alter_types(sa.String())
@@ -0,0 +1,31 @@
+"""Cover media hash lookups with a hash + file path index
+
+Revision ID: 9c4a1f6e2b87
+Revises: 3b7e52c9a1d4
+Create Date: 2026-10-14 09:12:47.530912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4a1f6e2b87'
+down_revision: Union[str, Sequence[str], None] = '3b7e52c9a1d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The composite index leads with the hash, so it replaces the single-column one
+    op.create_index('ix_interaction_hash_path', 'interactions', ['media_content_hash', 'media_file_path'], unique=False)
+    op.drop_index(op.f('ix_interactions_media_content_hash'), table_name='interactions')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_interactions_media_content_hash'), 'interactions', ['media_content_hash'], unique=False)
+    op.drop_index('ix_interaction_hash_path', table_name='interactions')
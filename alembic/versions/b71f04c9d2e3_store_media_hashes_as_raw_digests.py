@@ -0,0 +1,73 @@
+"""Store media content hashes as raw 32-byte digests
+
+Revision ID: b71f04c9d2e3
+Revises: 5e2d8b3f7a10
+Create Date: 2026-10-14 10:21:36.804517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71f04c9d2e3'
+down_revision: Union[str, Sequence[str], None] = '5e2d8b3f7a10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _rewrite_hashes(convert) -> None:
+    """Convert every stored media hash in place"""
+    bind = op.get_bind()
+    rows = bind.execute(sa.text(
+        "SELECT id, media_content_hash FROM interactions WHERE media_content_hash IS NOT NULL"
+    )).fetchall()
+    update = sa.text("UPDATE interactions SET media_content_hash = :hash WHERE id = :id")
+    for interaction_id, value in rows:
+        bind.execute(update, {'hash': convert(value), 'id': interaction_id})
+
+
+def _to_digest(value):
+    try:
+        return bytes.fromhex(value)
+    except (TypeError, ValueError):
+        return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def _to_hex(value):
+    value = bytes(value)
+    return value.hex() if len(value) == 32 else value.decode('utf-8')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column(
+            'interactions', 'media_content_hash',
+            existing_type=sa.String(),
+            type_=sa.LargeBinary(32),
+            postgresql_using="decode(media_content_hash, 'hex')"
+        )
+        return
+    
+    _rewrite_hashes(_to_digest)
+    with op.batch_alter_table('interactions') as batch_op:
+        batch_op.alter_column('media_content_hash', existing_type=sa.String(), type_=sa.LargeBinary(32))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column(
+            'interactions', 'media_content_hash',
+            existing_type=sa.LargeBinary(32),
+            type_=sa.String(),
+            postgresql_using="encode(media_content_hash, 'hex')"
+        )
+        return
+    
+    _rewrite_hashes(_to_hex)
+    with op.batch_alter_table('interactions') as batch_op:
+        batch_op.alter_column('media_content_hash', existing_type=sa.LargeBinary(32), type_=sa.String())
@@ -0,0 +1,28 @@
+"""Index memories by user and Mem0 id
+
+Revision ID: d4a7e19c3f52
+Revises: b71f04c9d2e3
+Create Date: 2026-10-14 11:05:12.418903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a7e19c3f52'
+down_revision: Union[str, Sequence[str], None] = 'b71f04c9d2e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_memory_user_mem0', 'memories', ['user_id', 'mem0_memory_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_memory_user_mem0', table_name='memories')
@@ -5,7 +5,9 @@ Seed script to populate the database with sample data for testing and evaluation
 import sys
 import os
 import json
+import argparse
 from datetime import datetime, timedelta
+from pathlib import Path
 
 # Add src directory to path to import modules
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -14,23 +16,36 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 from models import Base, User, Interaction, Memory
 
 # Create a custom database instance that doesn't use relative imports
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, insert, select, event
+from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 from typing import Optional, List, Dict, Any, Generator
 import json
 from datetime import datetime, timedelta
 
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL + relaxed fsync so commits don't pay a full journal sync each time"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+
 class Database:
     def __init__(self, db_url: str = "sqlite:///database.db"):
         if "sqlite" in db_url:
             self.engine = create_engine(
                 db_url,
                 echo=False,
-                connect_args={"check_same_thread": False}
+                connect_args={"check_same_thread": False},
+                insertmanyvalues_page_size=1000
             )
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
         else:
-            self.engine = create_engine(db_url, echo=False)
+            self.engine = create_engine(db_url, echo=False, insertmanyvalues_page_size=1000)
         
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         Base.metadata.create_all(bind=self.engine)
@@ -46,68 +61,12 @@ class Database:
             raise
         finally:
             session.close()
-    
-    def create_user(self, phone_number: str, whatsapp_id: str, timezone: str = "UTC") -> str:
-        with self.get_session() as session:
-            existing_user = session.query(User).filter_by(phone_number=phone_number).first()
-            if existing_user:
-                return existing_user.id
-            
-            user = User(
-                phone_number=phone_number,
-                whatsapp_id=whatsapp_id,
-                timezone=timezone
-            )
-            session.add(user)
-            session.flush()
-            return user.id
-    
-    def create_interaction(self, user_id: str, twilio_message_sid: str, message_type: str, 
-                          content: str = None, media_url: str = None, 
-                          media_file_path: str = None, media_content_hash: str = None,
-                          transcript: str = None) -> str:
-        with self.get_session() as session:
-            existing = session.query(Interaction).filter_by(
-                twilio_message_sid=twilio_message_sid
-            ).first()
-            if existing:
-                return existing.id
-            
-            interaction = Interaction(
-                user_id=user_id,
-                twilio_message_sid=twilio_message_sid,
-                message_type=message_type,
-                content=content,
-                media_url=media_url,
-                media_file_path=media_file_path,
-                media_content_hash=media_content_hash,
-                transcript=transcript
-            )
-            session.add(interaction)
-            session.flush()
-            return interaction.id
-    
-    def create_memory(self, user_id: str, interaction_id: str, mem0_memory_id: str, 
-                     memory_content: str, tags: List[str] = None) -> str:
-        with self.get_session() as session:
-            tags_json = json.dumps(tags) if tags else None
-            
-            memory = Memory(
-                user_id=user_id,
-                interaction_id=interaction_id,
-                mem0_memory_id=mem0_memory_id,
-                memory_content=memory_content,
-                tags=tags_json
-            )
-            session.add(memory)
-            session.flush()
-            return memory.id
 
 # Create database instance
 db = Database()
 import uuid
 
-def generate_sample_users():
+def generate_sample_users(session: Session):
     """Create sample users with different timezones"""
     users_data = [
         {
@@ -127,15 +86,28 @@ def generate_sample_users():
         }
     ]
     
-    user_ids = []
-    for user_data in users_data:
-        user_id = db.create_user(**user_data)
-        user_ids.append(user_id)
+    # Keep re-runs idempotent: reuse users that already exist
+    existing = dict(session.execute(
+        select(User.phone_number, User.id).where(
+            User.phone_number.in_([u["phone_number"] for u in users_data])
+        )
+    ).all())
+    
+    new_rows = [u for u in users_data if u["phone_number"] not in existing]
+    if new_rows:
+        new_ids = session.execute(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            new_rows
+        ).scalars().all()
+        existing.update(zip((u["phone_number"] for u in new_rows), new_ids))
+    
+    user_ids = [existing[u["phone_number"]] for u in users_data]
+    for user_data, user_id in zip(users_data, user_ids):
         print(f"Created user: {user_data['phone_number']} (ID: {user_id})")
     
     return user_ids
 
-def generate_sample_interactions(user_ids):
+def generate_sample_interactions(session: Session, user_ids):
     """Create sample interactions of different types with realistic timestamps"""
     interactions_data = [
         # Text interactions
@@ -197,93 +169,102 @@ def generate_sample_interactions(user_ids):
         }
     ]
     
-    interaction_ids = []
     base_time = datetime.now()
     
-    for i, interaction_data in enumerate(interactions_data):
+    # Generate unique Twilio message SIDs up front
+    message_sids = [f"SM{uuid.uuid4().hex}" for _ in interactions_data]
+    
+    rows = []
+    for interaction_data, message_sid in zip(interactions_data, message_sids):
         # Create realistic timestamps
         created_time = base_time - timedelta(days=interaction_data.pop("days_ago"))
         
-        # Generate unique Twilio message SID
-        interaction_data["twilio_message_sid"] = f"SM{str(uuid.uuid4()).replace('-', '')[:32]}"
-        
-        interaction_id = db.create_interaction(**interaction_data)
-        interaction_ids.append(interaction_id)
-        
-        # Update the created_at timestamp to simulate realistic timing
-        with db.get_session() as session:
-            interaction = session.get(Interaction, interaction_id)
-            if interaction:
-                interaction.created_at = created_time
-        
-        print(f"Created {interaction_data['message_type']} interaction: {interaction_id}")
+        # Uniform keys so every row goes out in the same executemany batch
+        rows.append({
+            "media_url": None,
+            "media_file_path": None,
+            "media_content_hash": None,
+            "transcript": None,
+            **interaction_data,
+            "twilio_message_sid": message_sid,
+            "created_at": created_time
+        })
+    
+    interaction_ids = session.execute(
+        insert(Interaction).returning(Interaction.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    
+    for row, interaction_id in zip(rows, interaction_ids):
+        print(f"Created {row['message_type']} interaction: {interaction_id}")
     
     return interaction_ids
 
-def generate_sample_memories(user_ids, interaction_ids):
+def generate_sample_memories(session: Session, user_ids, interaction_ids):
     """Create sample memories linked to interactions"""
     memories_data = [
         {
             "user_id": user_ids[0],
             "interaction_id": interaction_ids[0], 
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User plans to cook pasta with mushrooms and cheese for dinner",
             "tags": ["cooking", "dinner", "pasta", "recipe"]
         },
         {
             "user_id": user_ids[0],
             "interaction_id": interaction_ids[1],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User's grocery shopping list includes tomatoes, bread, milk, pasta, mushrooms, and parmesan cheese",
             "tags": ["grocery", "shopping", "food", "ingredients"]
         },
         {
             "user_id": user_ids[1],
             "interaction_id": interaction_ids[2],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User has a team meeting scheduled for tomorrow at 3 PM and needs to prepare presentation slides",
             "tags": ["work", "meeting", "presentation", "schedule"]
         },
         {
             "user_id": user_ids[0],
             "interaction_id": interaction_ids[3],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User got a new haircut and shared a photo showing the new look",
             "tags": ["personal", "appearance", "haircut", "photo"]
         },
         {
             "user_id": user_ids[2],
             "interaction_id": interaction_ids[4],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User shared a beautiful sunset photo from their beach vacation",
             "tags": ["vacation", "beach", "sunset", "photo", "travel"]
         },
         {
             "user_id": user_ids[1],
             "interaction_id": interaction_ids[5],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User's daily todos include grocery shopping, calling mom, finishing quarterly report, and booking dentist appointment",
             "tags": ["todos", "tasks", "personal", "work", "family"]
         },
         {
             "user_id": user_ids[2],
             "interaction_id": interaction_ids[6],
-            "mem0_memory_id": f"mem0_{str(uuid.uuid4())}",
             "memory_content": "User plans to visit new art gallery and try Italian restaurant this weekend",
             "tags": ["weekend", "plans", "art", "restaurant", "social"]
         }
     ]
     
-    memory_ids = []
-    for memory_data in memories_data:
-        memory_id = db.create_memory(**memory_data)
-        memory_ids.append(memory_id)
+    mem0_memory_ids = [f"mem0_{uuid.uuid4()}" for _ in memories_data]
+    rows = [
+        {**memory_data, "mem0_memory_id": mem0_memory_id}
+        for memory_data, mem0_memory_id in zip(memories_data, mem0_memory_ids)
+    ]
+    
+    memory_ids = session.execute(
+        insert(Memory).returning(Memory.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    
+    for memory_id in memory_ids:
         print(f"Created memory: {memory_id}")
     
     return memory_ids
 
-def create_sample_media_directories():
-    """Create media directories and placeholder files for demonstration"""
+def create_sample_media_directories(with_placeholders: bool = True):
+    """Create media directories and (empty) placeholder files for demonstration"""
     media_dirs = [
         "./media/images",
         "./media/audio", 
@@ -291,10 +272,13 @@ def create_sample_media_directories():
     ]
     
     for directory in media_dirs:
-        os.makedirs(directory, exist_ok=True)
+        Path(directory).mkdir(parents=True, exist_ok=True)
         print(f"Created directory: {directory}")
     
-    # Create placeholder files
+    if not with_placeholders:
+        return
+    
+    # Create placeholder files (seed data only references the paths)
     placeholder_files = [
         "./media/images/sample_haircut.jpg",
         "./media/images/sample_sunset.jpg",
@@ -303,29 +287,37 @@ def create_sample_media_directories():
     ]
     
     for file_path in placeholder_files:
-        if not os.path.exists(file_path):
-            with open(file_path, 'w') as f:
-                f.write(f"# Placeholder file for {os.path.basename(file_path)}\n")
-            print(f"Created placeholder: {file_path}")
+        Path(file_path).touch(exist_ok=True)
+        print(f"Created placeholder: {file_path}")
 
 def main():
     """Main seeding function"""
+    parser = argparse.ArgumentParser(description="Seed the database with sample data")
+    parser.add_argument(
+        "--with-placeholders",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Create empty placeholder media files (default: on)"
+    )
+    args = parser.parse_args()
+    
     print("🌱 Starting database seeding...")
     print("=" * 50)
     
     # Create media directories
     print("\n📁 Creating media directories...")
-    create_sample_media_directories()
-    
-    # Generate sample data
-    print("\n👥 Creating sample users...")
-    user_ids = generate_sample_users()
+    create_sample_media_directories(with_placeholders=args.with_placeholders)
     
-    print(f"\n💬 Creating sample interactions...")
-    interaction_ids = generate_sample_interactions(user_ids)
-    
-    print(f"\n🧠 Creating sample memories...")
-    memory_ids = generate_sample_memories(user_ids, interaction_ids)
+    # Generate sample data in a single transaction (one commit for the whole run)
+    with db.get_session() as session:
+        print("\n👥 Creating sample users...")
+        user_ids = generate_sample_users(session)
+        
+        print(f"\n💬 Creating sample interactions...")
+        interaction_ids = generate_sample_interactions(session, user_ids)
+        
+        print(f"\n🧠 Creating sample memories...")
+        memory_ids = generate_sample_memories(session, user_ids, interaction_ids)
     
     print("\n" + "=" * 50)
     print("✅ Database seeding completed successfully!")
@@ -1,17 +1,98 @@
 """
 Database operations using SQLAlchemy models and Alembic migrations
 """
-from sqlalchemy import create_engine, desc, func
+from sqlalchemy import create_engine, desc, func, event, lambda_stmt, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, Session
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any, Generator
-import json
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Generator, Iterator, Tuple
+import threading
+import time
 from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
 import pytz
 
 from .models import Base, User, Interaction, Memory
 
 
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """WAL + relaxed fsync so commits don't pay a full journal sync each time"""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.close()
+
+
+@lru_cache(maxsize=256)
+def _get_tz(name: str):
+    """Cached pytz timezone lookup (the same few zones recur across requests)"""
+    return pytz.timezone(name)
+
+
+def _start_of_day(now: datetime) -> datetime:
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _end_of_day(now: datetime) -> datetime:
+    return now.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+def _this_week_range(now: datetime, value) -> tuple:
+    start_date = _start_of_day(now) - timedelta(days=now.weekday())
+    return start_date, start_date + timedelta(days=7)
+
+
+def _last_week_range(now: datetime, value) -> tuple:
+    this_week_start = _start_of_day(now) - timedelta(days=now.weekday())
+    return this_week_start - timedelta(days=7), this_week_start
+
+
+def _this_month_range(now: datetime, value) -> tuple:
+    start_date = _start_of_day(now).replace(day=1)
+    return start_date, start_date + relativedelta(months=1)
+
+
+def _last_month_range(now: datetime, value) -> tuple:
+    end_date = _start_of_day(now).replace(day=1)
+    return end_date - relativedelta(months=1), end_date
+
+
+# time entity type -> (now, value) -> (start_date, end_date) in the user's timezone
+_DATE_RANGE_HANDLERS = {
+    'today': lambda now, v: (_start_of_day(now), _start_of_day(now) + timedelta(days=1)),
+    'yesterday': lambda now, v: (_start_of_day(now) - timedelta(days=1), _start_of_day(now)),
+    'this_week': _this_week_range,
+    'last_week': _last_week_range,
+    'this_month': _this_month_range,
+    'last_month': _last_month_range,
+    'days_ago': lambda now, v: (_end_of_day(now) - timedelta(days=int(v)), _end_of_day(now)),
+    'hours_ago': lambda now, v: (now - timedelta(hours=int(v)), now),
+    'last_hours': lambda now, v: (now - timedelta(hours=int(v)), now),
+    'weeks_ago': lambda now, v: (_end_of_day(now) - timedelta(weeks=int(v)), _end_of_day(now)),
+    'months_ago': lambda now, v: (_end_of_day(now) - relativedelta(months=int(v)), _end_of_day(now)),
+}
+
+
+# Analytics counts change slowly relative to dashboard hits
+ANALYTICS_CACHE_TTL = 30  # seconds
+
+# User rows are hit on every message but almost never change
+USER_CACHE_SIZE = 10_000
+USER_CACHE_TTL = 600  # seconds
+
+
+# Dialects that support INSERT ... ON CONFLICT DO NOTHING RETURNING
+_UPSERT_INSERTS = {
+    "sqlite": sqlite_insert,
+    "postgresql": pg_insert,
+}
+
+
 class Database:
     def __init__(self, db_url: str = "sqlite:///database.db"):
         # Simple SQLite configuration
@@ -19,68 +100,54 @@ class Database:
             self.engine = create_engine(
                 db_url,
                 echo=False,
-                connect_args={"check_same_thread": False}
+                connect_args={"check_same_thread": False},
+                query_cache_size=1200
             )
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
         else:
-            self.engine = create_engine(db_url, echo=False)
+            # LIFO keeps a small hot set of server connections warm
+            self.engine = create_engine(
+                db_url,
+                echo=False,
+                pool_size=20,
+                max_overflow=30,
+                pool_recycle=1800,
+                pool_pre_ping=True,
+                pool_use_lifo=True,
+                query_cache_size=1200
+            )
         
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self._user_cache_lock = threading.Lock()
+        self.clear_caches()
         
         # Create tables if they don't exist (for development)
         # In production, use alembic migrations
         Base.metadata.create_all(bind=self.engine)
     
+    def clear_caches(self) -> None:
+        """Drop every in-process cache, e.g. after rows were deleted behind our back"""
+        # (monotonic timestamp, summary) for get_analytics_summary
+        self._summary_cache: Optional[tuple] = None
+        
+        # phone number -> user id and user id -> user dict, each as
+        # key -> (monotonic timestamp, value) in LRU order
+        self._user_ids_by_phone: "OrderedDict[str, tuple]" = OrderedDict()
+        self._users_by_id: "OrderedDict[str, tuple]" = OrderedDict()
+        
+        # user id -> counter bumped on every new memory; lets callers cache
+        # per-user answers and drop them as soon as the user saves something
+        self._memory_versions: Dict[str, int] = {}
+    
     def _get_timezone_aware_date_range(self, time_entity: Dict, user_timezone: str) -> tuple:
         """Convert time entity to UTC date range for database queries"""
-        user_tz = pytz.timezone(user_timezone)
-        now = datetime.now(user_tz)
-        
-        if time_entity['type'] == 'today':
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date + timedelta(days=1)
-        elif time_entity['type'] == 'yesterday':
-            end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            start_date = end_date - timedelta(days=1)
-        elif time_entity['type'] == 'this_week':
-            days_since_monday = now.weekday()
-            start_date = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-            end_date = start_date + timedelta(days=7)
-        elif time_entity['type'] == 'last_week':
-            days_since_monday = now.weekday()
-            this_week_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-            start_date = this_week_start - timedelta(days=7)
-            end_date = this_week_start
-        elif time_entity['type'] == 'this_month':
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            next_month = start_date + timedelta(days=32)
-            end_date = next_month.replace(day=1)
-        elif time_entity['type'] == 'last_month':
-            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date
-            start_date = (start_date - timedelta(days=1)).replace(day=1)
-        elif time_entity['type'] == 'days_ago':
-            days = int(time_entity['value'])
-            end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            start_date = end_date - timedelta(days=days)
-        elif time_entity['type'] == 'hours_ago':
-            hours = int(time_entity['value'])
-            end_date = now
-            start_date = end_date - timedelta(hours=hours)
-        elif time_entity['type'] == 'last_hours':
-            hours = int(time_entity['value'])
-            end_date = now
-            start_date = end_date - timedelta(hours=hours)
-        elif time_entity['type'] == 'weeks_ago':
-            weeks = int(time_entity['value'])
-            end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            start_date = end_date - timedelta(weeks=weeks)
-        elif time_entity['type'] == 'months_ago':
-            months = int(time_entity['value'])
-            end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            start_date = end_date - timedelta(days=30 * months)  # Approximate
-        else:
+        handler = _DATE_RANGE_HANDLERS.get(time_entity['type'])
+        if handler is None:
             return None, None
         
+        now = datetime.now(_get_tz(user_timezone))
+        start_date, end_date = handler(now, time_entity.get('value'))
+        
         # Convert to UTC for database storage
         start_date_utc = start_date.astimezone(pytz.UTC).replace(tzinfo=None)
         end_date_utc = end_date.astimezone(pytz.UTC).replace(tzinfo=None)
@@ -100,88 +167,188 @@ class Database:
         finally:
             session.close()
     
-    def create_user(self, phone_number: str, whatsapp_id: str, timezone: str = "UTC") -> str:
-        """Create or get existing user"""
-        with self.get_session() as session:
-            # Check if user exists
-            existing_user = session.query(User).filter_by(phone_number=phone_number).first()
-            if existing_user:
-                return existing_user.id
+    @contextmanager
+    def _use_session(self, session: Optional[Session] = None) -> Generator[Session, None, None]:
+        """Reuse a caller-owned session (committed by the caller) or open a new one"""
+        if session is not None:
+            yield session
+        else:
+            with self.get_session() as new_session:
+                yield new_session
+    
+    def _insert_or_get_id(self, session: Session, model, conflict_column: str, **values) -> str:
+        """Insert a row unless `conflict_column` already matches, returning the row's ID"""
+        return self._insert_or_get(session, model, conflict_column, **values)[0]
+    
+    def _insert_or_get(self, session: Session, model, conflict_column: str, **values) -> Tuple[str, bool]:
+        """Insert a row unless `conflict_column` already matches; returns (row ID, inserted)
+        
+        Uses a single INSERT ... ON CONFLICT DO NOTHING RETURNING where the dialect
+        supports it, so the idempotency check doesn't cost an extra round-trip.
+        """
+        column = getattr(model, conflict_column)
+        insert_fn = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+        
+        if insert_fn is not None:
+            stmt = insert_fn(model).values(**values).on_conflict_do_nothing(
+                index_elements=[conflict_column]
+            ).returning(model.id)
+            inserted_id = session.execute(stmt).scalar()
+            if inserted_id is not None:
+                return inserted_id, True
+        else:
+            # Portable fallback: check then insert
+            existing_id = session.execute(
+                select(model.id).where(column == values[conflict_column])
+            ).scalar()
+            if existing_id is not None:
+                return existing_id, False
             
-            # Create new user
-            user = User(
+            obj = model(**values)
+            session.add(obj)
+            session.flush()  # Get the ID
+            return obj.id, True
+        
+        # Row already existed
+        return session.execute(
+            select(model.id).where(column == values[conflict_column])
+        ).scalar_one(), False
+    
+    def _user_cache_get(self, cache: OrderedDict, key: str):
+        """Fresh cached value for key, or None"""
+        with self._user_cache_lock:
+            entry = cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] >= USER_CACHE_TTL:
+                del cache[key]
+                return None
+            cache.move_to_end(key)
+            return entry[1]
+    
+    def _user_cache_put(self, cache: OrderedDict, key: str, value) -> None:
+        with self._user_cache_lock:
+            cache[key] = (time.monotonic(), value)
+            cache.move_to_end(key)
+            if len(cache) > USER_CACHE_SIZE:
+                cache.popitem(last=False)
+    
+    def create_user(self, phone_number: str, whatsapp_id: str, timezone: str = "UTC",
+                    session: Optional[Session] = None) -> str:
+        """Create or get existing user"""
+        # Only trust the cache (and fill it) for writes this call commits itself
+        if session is None:
+            user_id = self._user_cache_get(self._user_ids_by_phone, phone_number)
+            if user_id is not None:
+                return user_id
+        
+        with self._use_session(session) as active_session:
+            user_id = self._insert_or_get_id(
+                active_session, User, "phone_number",
                 phone_number=phone_number,
                 whatsapp_id=whatsapp_id,
                 timezone=timezone
             )
-            session.add(user)
-            session.flush()  # Get the ID
-            return user.id
+        
+        if session is None:
+            self._user_cache_put(self._user_ids_by_phone, phone_number, user_id)
+        return user_id
     
     def get_user_by_phone(self, phone_number: str) -> Optional[Dict]:
         """Get user by phone number"""
+        # lambda_stmt caches the constructed statement, not just its compiled SQL
+        stmt = lambda_stmt(lambda: select(User).where(User.phone_number == phone_number))
         with self.get_session() as session:
-            user = session.query(User).filter_by(phone_number=phone_number).first()
+            user = session.execute(stmt).scalars().first()
             if user:
                 return {
                     'id': user.id,
                     'phone_number': user.phone_number,
                     'whatsapp_id': user.whatsapp_id,
                     'timezone': user.timezone,
-                    'created_at': user.created_at.isoformat(),
-                    'updated_at': user.updated_at.isoformat()
+                    'created_at': user.created_at,
+                    'updated_at': user.updated_at
                 }
             return None
     
     def get_user_by_id(self, user_id: str) -> Optional[Dict]:
-        """Get user by user ID"""
+        """Get user by user ID (cached for USER_CACHE_TTL seconds)"""
+        cached = self._user_cache_get(self._users_by_id, user_id)
+        if cached is not None:
+            return dict(cached)  # Callers may modify the returned dict
+        
         with self.get_session() as session:
             user = session.get(User, user_id)
-            if user:
-                return {
-                    'id': user.id,
-                    'phone_number': user.phone_number,
-                    'whatsapp_id': user.whatsapp_id,
-                    'timezone': user.timezone,
-                    'created_at': user.created_at.isoformat(),
-                    'updated_at': user.updated_at.isoformat()
-                }
-            return None
+            if not user:
+                return None
+            user_dict = {
+                'id': user.id,
+                'phone_number': user.phone_number,
+                'whatsapp_id': user.whatsapp_id,
+                'timezone': user.timezone,
+                'created_at': user.created_at,
+                'updated_at': user.updated_at
+            }
+        
+        self._user_cache_put(self._users_by_id, user_id, user_dict)
+        return dict(user_dict)
+    
+    def forget_user(self, user_id: str, phone_number: Optional[str] = None) -> None:
+        """Drop cached entries for a user; call after changing the user row"""
+        with self._user_cache_lock:
+            self._users_by_id.pop(user_id, None)
+            if phone_number is not None:
+                self._user_ids_by_phone.pop(phone_number, None)
     
     def create_interaction(self, user_id: str, twilio_message_sid: str, message_type: str, 
                           content: str = None, media_url: str = None, 
                           media_file_path: str = None, media_content_hash: str = None,
-                          transcript: str = None) -> str:
+                          transcript: str = None, created_at: datetime = None,
+                          session: Optional[Session] = None) -> str:
         """Create new interaction with idempotency check"""
+        values = dict(
+            user_id=user_id,
+            twilio_message_sid=twilio_message_sid,
+            message_type=message_type,
+            content=content,
+            media_url=media_url,
+            media_file_path=media_file_path,
+            media_content_hash=media_content_hash,
+            transcript=transcript
+        )
+        if created_at:
+            # Backdated rows (seed/import) set the timestamp at INSERT time
+            values['created_at'] = created_at
+        
+        with self._use_session(session) as session:
+            # Idempotent on the Twilio message SID
+            return self._insert_or_get_id(session, Interaction, "twilio_message_sid", **values)
+    
+    def claim_interaction(self, user_id: str, twilio_message_sid: str, message_type: str,
+                          content: str = None, media_url: str = None) -> Optional[str]:
+        """Record the interaction for a new message SID; None if the SID was already recorded
+        
+        The insert doubles as the idempotency check, so new messages cost one
+        statement instead of a lookup followed by an insert.
+        """
         with self.get_session() as session:
-            # Check for existing interaction (idempotency)
-            existing = session.query(Interaction).filter_by(
-                twilio_message_sid=twilio_message_sid
-            ).first()
-            if existing:
-                return existing.id
-            
-            # Create new interaction
-            interaction = Interaction(
+            interaction_id, inserted = self._insert_or_get(
+                session, Interaction, "twilio_message_sid",
                 user_id=user_id,
                 twilio_message_sid=twilio_message_sid,
                 message_type=message_type,
                 content=content,
-                media_url=media_url,
-                media_file_path=media_file_path,
-                media_content_hash=media_content_hash,
-                transcript=transcript
+                media_url=media_url
             )
-            session.add(interaction)
-            session.flush()
-            return interaction.id
+        return interaction_id if inserted else None
     
     def get_interaction_by_sid(self, twilio_message_sid: str) -> Optional[Dict]:
         """Get interaction by Twilio message SID"""
+        stmt = lambda_stmt(
+            lambda: select(Interaction).where(Interaction.twilio_message_sid == twilio_message_sid)
+        )
         with self.get_session() as session:
-            interaction = session.query(Interaction).filter_by(
-                twilio_message_sid=twilio_message_sid
-            ).first()
+            interaction = session.execute(stmt).scalars().first()
             
             if interaction:
                 return {
@@ -194,78 +361,121 @@ class Database:
                     'media_file_path': interaction.media_file_path,
                     'media_content_hash': interaction.media_content_hash,
                     'transcript': interaction.transcript,
-                    'created_at': interaction.created_at.isoformat()
+                    'created_at': interaction.created_at
                 }
             return None
     
     def check_media_exists(self, content_hash: str) -> Optional[str]:
         """Check if media with this hash already exists"""
+        stmt = lambda_stmt(
+            lambda: select(Interaction.media_file_path).where(
+                Interaction.media_content_hash == content_hash
+            ).limit(1)
+        )
         with self.get_session() as session:
-            interaction = session.query(Interaction).filter_by(
-                media_content_hash=content_hash
-            ).first()
-            return interaction.media_file_path if interaction else None
+            return session.execute(stmt).scalar()
     
     def update_interaction(self, interaction_id: str, media_file_path: str = None, 
                           media_content_hash: str = None, transcript: str = None) -> None:
         """Update interaction with processed media information"""
+        values = {
+            key: value for key, value in (
+                ('media_file_path', media_file_path),
+                ('media_content_hash', media_content_hash),
+                ('transcript', transcript)
+            ) if value
+        }
+        if not values:
+            return
+        
+        # Single UPDATE; no need to load the row first
         with self.get_session() as session:
-            interaction = session.get(Interaction, interaction_id)
-            if interaction:
-                if media_file_path:
-                    interaction.media_file_path = media_file_path
-                if media_content_hash:
-                    interaction.media_content_hash = media_content_hash
-                if transcript:
-                    interaction.transcript = transcript
+            session.execute(
+                update(Interaction).where(Interaction.id == interaction_id).values(**values)
+            )
     
     def create_memory(self, user_id: str, interaction_id: str, mem0_memory_id: str, 
-                     memory_content: str, tags: List[str] = None) -> str:
+                     memory_content: str, tags: List[str] = None,
+                     session: Optional[Session] = None) -> str:
         """Create memory record"""
-        with self.get_session() as session:
-            tags_json = json.dumps(tags) if tags else None
-            
+        with self._use_session(session) as session:
             memory = Memory(
                 user_id=user_id,
                 interaction_id=interaction_id,
                 mem0_memory_id=mem0_memory_id,
                 memory_content=memory_content,
-                tags=tags_json
+                tags=tags or None
             )
             session.add(memory)
             session.flush()
-            return memory.id
+            memory_id = memory.id
+        
+        self._memory_versions[user_id] = self._memory_versions.get(user_id, 0) + 1
+        return memory_id
+    
+    def memory_version(self, user_id: str) -> int:
+        """Counter that changes whenever a memory is added for the user"""
+        return self._memory_versions.get(user_id, 0)
     
     def get_memories_for_user(self, user_id: str, limit: int = 50, user_timezone: str = 'UTC', 
                               start_date: datetime = None, end_date: datetime = None) -> List[Dict]:
         """Get all memories for a user, newest first with optional timezone-aware date filtering"""
+        stmt = self._select_user_memories(user_id, start_date, end_date)
+        stmt = stmt.order_by(desc(Memory.created_at)).limit(limit)
+        
         with self.get_session() as session:
-            query = session.query(Memory, Interaction).join(
-                Interaction, Memory.interaction_id == Interaction.id
-            ).filter(Memory.user_id == user_id)
-            
-            # Add date range filtering if provided
-            if start_date:
-                query = query.filter(Memory.created_at >= start_date)
-            if end_date:
-                query = query.filter(Memory.created_at < end_date)
-                
-            query = query.order_by(desc(Memory.created_at)).limit(limit)
-            
-            results = []
-            for memory, interaction in query.all():
-                results.append({
-                    'id': memory.id,
-                    'user_id': memory.user_id,
-                    'interaction_id': memory.interaction_id,
-                    'mem0_memory_id': memory.mem0_memory_id,
-                    'memory_content': memory.memory_content,
-                    'tags': memory.tags,
-                    'created_at': memory.created_at.isoformat(),
-                    'message_type': interaction.message_type,
-                    'interaction_date': interaction.created_at.isoformat()
-                })
-            return results
+            return [dict(row) for row in session.execute(stmt).mappings()]
+    
+    def iter_memories_for_user(self, user_id: str, batch_size: int = 100) -> Iterator[Dict]:
+        """Yield all of a user's memories newest first, fetching batch_size rows at a time"""
+        stmt = self._select_user_memories(user_id).order_by(desc(Memory.created_at))
+        
+        with self.get_session() as session:
+            result = session.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+            for row in result.mappings():
+                yield dict(row)
+    
+    def get_memories_by_mem0_ids(self, user_id: str, mem0_memory_ids: List[str],
+                                 time_entities: List[Dict] = None, user_timezone: str = 'UTC') -> List[Dict]:
+        """Get a user's memories matching the given Mem0 ids, with optional time filtering"""
+        if not mem0_memory_ids:
+            return []
+        
+        start_date = end_date = None
+        if time_entities:
+            start_date, end_date = self._get_timezone_aware_date_range(time_entities[0], user_timezone)
+        
+        stmt = self._select_user_memories(user_id, start_date, end_date).where(
+            Memory.mem0_memory_id.in_(mem0_memory_ids)
+        ).order_by(desc(Memory.created_at))
+        
+        with self.get_session() as session:
+            return [dict(row) for row in session.execute(stmt).mappings()]
+    
+    def _select_user_memories(self, user_id: str, start_date: datetime = None, end_date: datetime = None):
+        """Memory rows for a user joined with their interaction, optionally within a date range"""
+        # Project only the columns we return instead of hydrating both ORM entities
+        stmt = select(
+            Memory.id,
+            Memory.user_id,
+            Memory.interaction_id,
+            Memory.mem0_memory_id,
+            Memory.memory_content,
+            Memory.tags,
+            Memory.created_at,
+            Interaction.message_type,
+            Interaction.created_at.label('interaction_date')
+        ).join(
+            Interaction, Memory.interaction_id == Interaction.id
+        ).where(Memory.user_id == user_id)
+        
+        # Add date range filtering if provided
+        if start_date:
+            stmt = stmt.where(Memory.created_at >= start_date)
+        if end_date:
+            stmt = stmt.where(Memory.created_at < end_date)
+        
+        return stmt
     
     def get_memories_for_user_with_time_filter(self, user_id: str, time_entities: List[Dict], 
                                              user_timezone: str = 'UTC', limit: int = 50) -> List[Dict]:
@@ -290,38 +500,51 @@ class Database:
     
     def get_recent_interactions(self, user_id: str = None, limit: int = 10) -> List[Dict]:
         """Get recent interactions, optionally filtered by user"""
+        # Project only the returned columns instead of hydrating both ORM entities
+        stmt = select(
+            Interaction.id,
+            Interaction.user_id,
+            Interaction.twilio_message_sid,
+            Interaction.message_type,
+            Interaction.content,
+            Interaction.media_url,
+            Interaction.media_file_path,
+            Interaction.media_content_hash,
+            Interaction.transcript,
+            Interaction.created_at,
+            User.phone_number
+        ).join(User, Interaction.user_id == User.id)
+        
+        if user_id:
+            stmt = stmt.where(Interaction.user_id == user_id)
+        
+        stmt = stmt.order_by(desc(Interaction.created_at)).limit(limit)
+        
         with self.get_session() as session:
-            query = session.query(Interaction, User).join(
-                User, Interaction.user_id == User.id
-            ).order_by(desc(Interaction.created_at)).limit(limit)
-            
-            if user_id:
-                query = query.filter(Interaction.user_id == user_id)
-            
-            results = []
-            for interaction, user in query.all():
-                results.append({
-                    'id': interaction.id,
-                    'user_id': interaction.user_id,
-                    'twilio_message_sid': interaction.twilio_message_sid,
-                    'message_type': interaction.message_type,
-                    'content': interaction.content,
-                    'media_url': interaction.media_url,
-                    'media_file_path': interaction.media_file_path,
-                    'media_content_hash': interaction.media_content_hash,
-                    'transcript': interaction.transcript,
-                    'created_at': interaction.created_at.isoformat(),
-                    'phone_number': user.phone_number
-                })
-            return results
+            return [dict(row) for row in session.execute(stmt).mappings()]
     
     def get_analytics_summary(self) -> Dict[str, Any]:
-        """Get analytics summary from database"""
+        """Get analytics summary from database, cached for ANALYTICS_CACHE_TTL seconds"""
+        if self._summary_cache is not None:
+            cached_at, summary = self._summary_cache
+            if time.monotonic() - cached_at < ANALYTICS_CACHE_TTL:
+                return dict(summary)  # Callers add keys to the returned dict
+        
+        summary = self._compute_analytics_summary()
+        self._summary_cache = (time.monotonic(), summary)
+        return dict(summary)
+    
+    def _compute_analytics_summary(self) -> Dict[str, Any]:
+        """Run the analytics queries"""
         with self.get_session() as session:
-            # Total counts
-            total_users = session.query(User).count()
-            total_interactions = session.query(Interaction).count()
-            total_memories = session.query(Memory).count()
+            # Total counts in a single round-trip
+            total_users, total_interactions, total_memories = session.execute(
+                select(
+                    select(func.count()).select_from(User).scalar_subquery(),
+                    select(func.count()).select_from(Interaction).scalar_subquery(),
+                    select(func.count()).select_from(Memory).scalar_subquery()
+                )
+            ).one()
             
             # Interactions by type
             interactions_by_type = {}
@@ -334,10 +557,8 @@ class Database:
                 interactions_by_type[message_type] = count
             
             # Last ingest time
-            last_interaction = session.query(Interaction).order_by(
-                desc(Interaction.created_at)
-            ).first()
-            last_ingest = last_interaction.created_at.isoformat() if last_interaction else None
+            last_created_at = session.execute(select(func.max(Interaction.created_at))).scalar()
+            last_ingest = last_created_at.isoformat() if last_created_at else None
             
             # Most active users
             top_users_query = session.query(
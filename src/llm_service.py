@@ -1,12 +1,72 @@
 import os
-import base64
-import json
-from typing import Dict, Any, Optional
+import orjson
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from functools import cache, lru_cache
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
+import httpx
 from dotenv import load_dotenv
 
+try:
+    # SIMD base64 when available; same API as the stdlib module
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 load_dotenv()
 
+# Max cached image results; bump a prompt version below when its prompt changes
+IMAGE_CACHE_SIZE = 1024
+
+# Concurrent LLM requests allowed per process, and attempts per request
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_ATTEMPTS = 5
+LLM_MAX_BACKOFF = 30.0  # seconds
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying after error, or None if it isn't retryable"""
+    status = getattr(error, "status_code", None)
+    if status not in _RETRYABLE_STATUS and type(error).__name__ not in _RETRYABLE_ERRORS \
+            and not isinstance(error, httpx.TransportError):
+        return None
+    
+    # Honor the provider's Retry-After when it sends one
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(float(retry_after), LLM_MAX_BACKOFF)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, LLM_MAX_BACKOFF) + random.random()
+
+
+def _is_stream_rejection(error: Exception) -> bool:
+    """True for a 400 saying streaming or structured output isn't supported"""
+    if getattr(error, "status_code", None) != 400:
+        return False
+    message = str(error).lower()
+    return "stream" in message or "json_schema" in message or "response_format" in message
+
+
+@cache
+def _fmt_for_suffix(suffix: str) -> str:
+    """Image format for a file suffix, e.g. '.JPG' -> 'jpeg'; defaults to jpeg"""
+    image_format = suffix.lower().lstrip('.')
+    return 'jpeg' if image_format == 'jpg' else (image_format or 'jpeg')
+
+
+@cache
+def _image_url_prefix(suffix: str) -> str:
+    """Data URL prefix for an image file suffix, e.g. '.JPG' -> 'data:image/jpeg;base64,'"""
+    return f"data:image/{_fmt_for_suffix(suffix)};base64,"
+
 
 class LLMService:
     """
@@ -17,18 +77,88 @@ class LLMService:
     - PORTKEY_VIRTUAL_KEY: Virtual key for your OpenRouter/LLM provider
     - LLM_MODEL: Model to use (default: gpt-4o-mini)
     """
+    _PROMPT_IMAGE = "Provide a concise, descriptive summary of this image in 1-2 sentences. Focus on the main subjects, setting, and key details that would help someone understand what they're looking at."
+    
+    _PROMPT_INSIGHTS = """Analyze the following content and extract insights in JSON format:
+
+Content: {content}
+Content Type: {content_type}
+
+Please provide a JSON response with:
+1. "tags": Array of 2-4 relevant tags (e.g., ["food", "social", "planning"])
+2. "category": Main category (e.g., "food", "productivity", "personal", "shopping", "entertainment", "travel", "health", "work", "social", "general")
+3. "sentiment": Emotional tone ("positive", "negative", "neutral")
+
+Respond ONLY with valid JSON, no additional text."""
+    
+    _PROMPT_COMBINED = """Analyze this image and provide a JSON response with:
+
+1. "description": Concise 1-2 sentence description of the image
+2. "tags": Array of 2-4 relevant tags based on image content
+3. "category": Main category (food, personal, social, work, entertainment, travel, health, shopping, general)
+4. "sentiment": Emotional tone of the image (positive, negative, neutral)
+
+"""
+    
+    _PROMPT_JSON_ONLY = "Respond ONLY with valid JSON, no additional text."
+    
+    _PROMPT_IMAGE_VERSION = "image-v1"
+    _PROMPT_COMBINED_VERSION = "combined-v2"
+    
+    _INSIGHT_PROPERTIES = {
+        "tags": {"type": "array", "items": {"type": "string"}},
+        "category": {"type": "string"},
+        "sentiment": {"type": "string", "enum": ["positive", "negative", "neutral"]}
+    }
+    
+    _SCHEMA_INSIGHTS = {
+        "name": "content_insights",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": _INSIGHT_PROPERTIES,
+            "required": ["tags", "category", "sentiment"],
+            "additionalProperties": False
+        }
+    }
+    
+    _SCHEMA_IMAGE = {
+        "name": "image_insights",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"description": {"type": "string"}, **_INSIGHT_PROPERTIES},
+            "required": ["description", "tags", "category", "sentiment"],
+            "additionalProperties": False
+        }
+    }
+    
     def __init__(self):
         self.portkey_api_key = os.getenv("PORTKEY_API_KEY")
         self.portkey_virtual_key = os.getenv("PORTKEY_VIRTUAL_KEY")
         self.model = os.getenv("LLM_MODEL", "gpt-4o-mini")  # Default to gpt-4o-mini
         
+        # LRU of image results keyed by model, prompt version and content hash
+        self._img_cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._img_cache_lock = threading.Lock()
+        
+        # Caps in-flight LLM requests so a burst of messages can't exhaust the worker threads
+        self._llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+        
+        # Shared keep-alive pool so calls reuse warm TCP/TLS connections
+        self._http = httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+        
         # Initialize Portkey client
         try:
             from portkey_ai import Portkey
             if self.portkey_api_key and self.portkey_virtual_key:
                 self.client = Portkey(
                     api_key=self.portkey_api_key,
-                    virtual_key=self.portkey_virtual_key
+                    virtual_key=self.portkey_virtual_key,
+                    http_client=self._http
                 )
             else:
                 print("Warning: Portkey credentials not found, LLM features disabled")
@@ -37,16 +167,48 @@ class LLMService:
             print(f"Warning: Could not initialize Portkey client: {e}")
             self.client = None
     
-    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
-        """Convert local image file to base64 string"""
+    def close(self) -> None:
+        """Close pooled HTTP connections"""
+        self._http.close()
+    
+    def read_image(self, image_path: str) -> Optional[Tuple[bytes, str]]:
+        """Read local image file, returning raw bytes and base64 string"""
         try:
             with open(image_path, "rb") as image_file:
-                encoded = base64.b64encode(image_file.read()).decode('utf-8')
-            return encoded
+                raw = image_file.read()
+            return raw, base64.b64encode(raw).decode('ascii')
         except Exception as e:
             print(f"Error encoding image to base64: {e}")
             return None
     
+    def encode_image_to_base64(self, image_path: str) -> Optional[str]:
+        """Convert local image file to base64 string"""
+        image = self.read_image(image_path)
+        return image[1] if image else None
+    
+    def _image_cache_key(self, prompt_version: str, raw: bytes, extra: str = None) -> str:
+        """Cache key for an image result"""
+        digest = hashlib.blake2b(raw, digest_size=16)
+        if extra:
+            digest.update(b"\0" + extra.encode('utf-8'))
+        return f"{self.model}:{prompt_version}:{digest.hexdigest()}"
+    
+    def _image_cache_get(self, key: str) -> Optional[Any]:
+        """Look up a cached image result, marking it recently used"""
+        with self._img_cache_lock:
+            result = self._img_cache.get(key)
+            if result is not None:
+                self._img_cache.move_to_end(key)
+            return result
+    
+    def _image_cache_put(self, key: str, result: Any) -> None:
+        """Store an image result, evicting the least recently used entry"""
+        with self._img_cache_lock:
+            self._img_cache[key] = result
+            self._img_cache.move_to_end(key)
+            if len(self._img_cache) > IMAGE_CACHE_SIZE:
+                self._img_cache.popitem(last=False)
+    
     def analyze_image(self, image_path: str) -> Optional[str]:
         """Analyze image and return descriptive text using LLM"""
         if not self.client:
@@ -54,29 +216,31 @@ class LLMService:
         
         try:
             # Encode image to base64
-            base64_image = self.encode_image_to_base64(image_path)
-            if not base64_image:
+            image = self.read_image(image_path)
+            if not image:
                 return f"Image file: {Path(image_path).name}"
+            raw, base64_image = image
             
-            # Determine image format
-            image_format = Path(image_path).suffix.lower().replace('.', '')
-            if image_format == 'jpg':
-                image_format = 'jpeg'
+            # Identical media is forwarded often; skip the LLM on a repeat
+            cache_key = self._image_cache_key(self._PROMPT_IMAGE_VERSION, raw)
+            cached = self._image_cache_get(cache_key)
+            if cached is not None:
+                return cached
             
             # Create LLM request for image analysis
-            response = self.client.chat.completions.create(
+            response = self._complete(
                 model=self.model,
                 messages=[{
                     "role": "user",
                     "content": [
                         {
                             "type": "text",
-                            "text": "Provide a concise, descriptive summary of this image in 1-2 sentences. Focus on the main subjects, setting, and key details that would help someone understand what they're looking at."
+                            "text": self._PROMPT_IMAGE
                         },
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/{image_format};base64,{base64_image}"
+                                "url": _image_url_prefix(os.path.splitext(image_path)[1]) + base64_image
                             }
                         }
                     ]
@@ -85,7 +249,12 @@ class LLMService:
             )
             
             description = response.choices[0].message.content
-            return description.strip() if description else f"Image file: {Path(image_path).name}"
+            if not description:
+                return f"Image file: {Path(image_path).name}"
+            
+            description = description.strip()
+            self._image_cache_put(cache_key, description)
+            return description
             
         except Exception as e:
             print(f"Error analyzing image with LLM: {e}")
@@ -94,176 +263,212 @@ class LLMService:
     def extract_content_insights(self, content: str, content_type: str = "text", 
                                image_description: str = None) -> Dict[str, Any]:
         """Extract insights, tags, categories, and sentiment from content using LLM"""
-        if not self.client:
-            # Fallback to basic structure
-            return {
-                "tags": [],
-                "category": "general",
-                "sentiment": "neutral"
-            }
+        # Prepare content for analysis
+        analysis_content = content
+        if image_description and content_type == "image":
+            analysis_content = f"Image description: {image_description}"
+        elif image_description and content:
+            analysis_content = f"Text: {content}\nImage description: {image_description}"
         
-        try:
-            # Prepare content for analysis
-            analysis_content = content
-            if image_description and content_type == "image":
-                analysis_content = f"Image description: {image_description}"
-            elif image_description and content:
-                analysis_content = f"Text: {content}\nImage description: {image_description}"
-            
-            # Create LLM request for content insights
-            prompt = f"""Analyze the following content and extract insights in JSON format:
-
-Content: {analysis_content}
-Content Type: {content_type}
-
-Please provide a JSON response with:
-1. "tags": Array of 2-4 relevant tags (e.g., ["food", "social", "planning"])
-2. "category": Main category (e.g., "food", "productivity", "personal", "shopping", "entertainment", "travel", "health", "work", "social", "general")
-3. "sentiment": Emotional tone ("positive", "negative", "neutral")
-
-Respond ONLY with valid JSON, no additional text."""
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }],
-                max_tokens=100,
-                temperature=0.3  # Lower temperature for more consistent responses
-            )
-            
-            # Parse JSON response
-            response_text = response.choices[0].message.content
-            if not response_text:
-                raise ValueError("Empty response from LLM")
-            
-            response_text = response_text.strip()
-            # Remove any markdown code blocks if present
-            if response_text.startswith('```json'):
-                response_text = response_text[7:]
-            if response_text.endswith('```'):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-            
-            insights = json.loads(response_text)
-            
-            # Validate and clean response
-            if not isinstance(insights.get("tags"), list):
-                insights["tags"] = []
-            if not isinstance(insights.get("category"), str):
-                insights["category"] = "general"
-            if insights.get("sentiment") not in ["positive", "negative", "neutral"]:
-                insights["sentiment"] = "neutral"
-            
-            return insights
-            
-        except Exception as e:
-            print(f"Error extracting content insights with LLM: {e}")
-            # Fallback response
-            return {
-                "tags": [],
-                "category": "general", 
-                "sentiment": "neutral"
-            }
+        return self.analyze_all(text=analysis_content, content_type=content_type)
     
     def analyze_image_with_content_insights(self, image_path: str, 
-                                          additional_content: str = None) -> Dict[str, Any]:
+                                          additional_content: str = None, *,
+                                          image_bytes: bytes = None, mime: str = None) -> Dict[str, Any]:
         """Combined image analysis and content insights extraction to minimize API calls"""
-        if not self.client:
-            return {
+        return self.analyze_all(text=additional_content, image_path=image_path,
+                                image_bytes=image_bytes, mime=mime)
+    
+    def analyze_all(self, *, text: str = None, image_path: str = None,
+                    image_bytes: bytes = None, mime: str = None,
+                    content_type: str = "text") -> Dict[str, Any]:
+        """Description (for images), tags, category and sentiment in a single structured-output call
+        
+        With an image, any text is sent alongside it as extra context; otherwise
+        the text itself is analyzed and no description is returned. Callers that
+        already hold the image in memory pass image_bytes (and its mime type)
+        to skip re-reading image_path from disk.
+        """
+        if image_path:
+            fallback = {
                 "description": f"Image file: {Path(image_path).name}",
                 "tags": [],
                 "category": "general",
                 "sentiment": "neutral"
             }
+        else:
+            fallback = {
+                "tags": [],
+                "category": "general",
+                "sentiment": "neutral"
+            }
+        
+        if not self.client:
+            return fallback
         
         try:
-            # Encode image to base64
-            base64_image = self.encode_image_to_base64(image_path)
-            if not base64_image:
-                return {
-                    "description": f"Image file: {Path(image_path).name}",
-                    "tags": [],
-                    "category": "general", 
-                    "sentiment": "neutral"
-                }
-            
-            # Determine image format
-            image_format = Path(image_path).suffix.lower().replace('.', '')
-            if image_format == 'jpg':
-                image_format = 'jpeg'
-            
-            # Create comprehensive analysis prompt
-            prompt = """Analyze this image and provide a JSON response with:
-
-1. "description": Concise 1-2 sentence description of the image
-2. "tags": Array of 2-4 relevant tags based on image content
-3. "category": Main category (food, personal, social, work, entertainment, travel, health, shopping, general)
-4. "sentiment": Emotional tone of the image (positive, negative, neutral)
-
-"""
-            
-            if additional_content:
-                prompt += f"\nAlso consider this additional context: {additional_content}\n"
-            
-            prompt += "Respond ONLY with valid JSON, no additional text."
-            
-            # Single API call for image + insights
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{
+            cache_key = None
+            if image_path:
+                # Encode image to base64
+                if image_bytes is not None:
+                    raw, base64_image = image_bytes, base64.b64encode(image_bytes).decode('ascii')
+                else:
+                    image = self.read_image(image_path)
+                    if not image:
+                        return fallback
+                    raw, base64_image = image
+                
+                cache_key = self._image_cache_key(self._PROMPT_COMBINED_VERSION, raw, text)
+                cached = self._image_cache_get(cache_key)
+                if cached is not None:
+                    return dict(cached)
+                
+                # Create comprehensive analysis prompt
+                prompt = self._PROMPT_COMBINED
+                if text:
+                    prompt += f"\nAlso consider this additional context: {text}\n"
+                prompt += self._PROMPT_JSON_ONLY
+                
+                messages = [{
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/{image_format};base64,{base64_image}"
+                                "url": (f"data:{mime};base64," if mime else _image_url_prefix(os.path.splitext(image_path)[1])) + base64_image
                             }
                         }
                     ]
-                }],
-                max_tokens=200,
-                temperature=0.3
-            )
-            
-            # Parse JSON response
-            response_text = response.choices[0].message.content
-            if not response_text:
-                raise ValueError("Empty response from LLM")
+                }]
+                schema, max_tokens = self._SCHEMA_IMAGE, 200
+            else:
+                messages = [{
+                    "role": "user",
+                    "content": self._PROMPT_INSIGHTS.format(content=text, content_type=content_type)
+                }]
+                schema, max_tokens = self._SCHEMA_INSIGHTS, 100
             
-            response_text = response_text.strip()
-            # Remove any markdown code blocks if present
-            if response_text.startswith('```json'):
-                response_text = response_text[7:]
-            if response_text.endswith('```'):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
+            request = {
+                "model": self.model,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": 0.3,  # Lower temperature for more consistent responses
+                "response_format": {"type": "json_schema", "json_schema": schema}
+            }
             
-            result = json.loads(response_text)
+            try:
+                response_text = self._stream_json_object(request)
+            except Exception as e:
+                # Rate limits and transient errors already used their retries; only
+                # stream-specific failures are worth a non-streaming attempt
+                if not (isinstance(e, ValueError) or _is_stream_rejection(e)):
+                    raise
+                print(f"Streamed LLM response unusable, retrying without streaming: {e}")
+                response = self._complete(**request)
+                response_text = response.choices[0].message.content
             
-            # Validate and clean response
-            if not isinstance(result.get("description"), str):
-                result["description"] = f"Image file: {Path(image_path).name}"
-            if not isinstance(result.get("tags"), list):
-                result["tags"] = []
-            if not isinstance(result.get("category"), str):
-                result["category"] = "general"
-            if result.get("sentiment") not in ["positive", "negative", "neutral"]:
-                result["sentiment"] = "neutral"
+            result = self._parse_llm_json(response_text, fallback)
             
+            if cache_key and result != fallback:
+                self._image_cache_put(cache_key, dict(result))
             return result
             
         except Exception as e:
-            print(f"Error in combined image analysis: {e}")
-            return {
-                "description": f"Image file: {Path(image_path).name}",
-                "tags": [],
-                "category": "general",
-                "sentiment": "neutral"
-            }
+            print(f"Error analyzing content with LLM: {e}")
+            return fallback
+    
+    def _parse_llm_json(self, text: Optional[str], defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse an LLM JSON answer, tolerating a markdown fence, and fill invalid fields from defaults"""
+        if not text:
+            print("Empty response from LLM")
+            return dict(defaults)
+        
+        # Structured output should be bare JSON, but not every provider behind the gateway honors it
+        text = text.strip()
+        text = text.removeprefix('```json').removeprefix('```').removesuffix('```').strip()
+        
+        try:
+            result = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            print(f"Invalid JSON from LLM: {e}")
+            return dict(defaults)
+        if not isinstance(result, dict):
+            return dict(defaults)
+        
+        # Validate and clean response
+        if "description" in defaults and not isinstance(result.get("description"), str):
+            result["description"] = defaults["description"]
+        if not isinstance(result.get("tags"), list):
+            result["tags"] = list(defaults["tags"])
+        if not isinstance(result.get("category"), str):
+            result["category"] = defaults["category"]
+        if result.get("sentiment") not in ["positive", "negative", "neutral"]:
+            result["sentiment"] = defaults["sentiment"]
+        
+        return result
+    
+    def _complete(self, **request):
+        """Chat completion under the concurrency limit, retried on transient errors"""
+        with self._llm_slots:
+            return self._create_with_retry(**request)
+    
+    def _create_with_retry(self, **request):
+        """Chat completion retried with exponential backoff and jitter on rate limits and transient errors"""
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            try:
+                return self.client.chat.completions.create(**request)
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt == LLM_MAX_ATTEMPTS - 1:
+                    raise
+                print(f"LLM request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+    
+    def _stream_json_object(self, request: Dict[str, Any]) -> str:
+        """Stream a completion and stop as soon as its top-level JSON object closes"""
+        # Hold a slot for the whole stream, not just the initial request
+        with self._llm_slots:
+            return self._read_json_object(self._create_with_retry(**request, stream=True))
+    
+    def _read_json_object(self, stream) -> str:
+        """Consume a completion stream up to the end of its top-level JSON object"""
+        parts = []
+        depth = 0
+        in_string = escaped = False
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content or ''
+                for i, char in enumerate(text):
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == '\\':
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = True
+                    elif char == '{':
+                        depth += 1
+                    elif char == '}':
+                        depth -= 1
+                        if depth == 0:
+                            # Done; skip waiting on the trailing tokens
+                            parts.append(text[:i + 1])
+                            return ''.join(parts)
+                parts.append(text)
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+        
+        raise ValueError(f"Incomplete JSON in streamed LLM response: {''.join(parts)[:100]}")
 
 
-# Global LLM service instance
-llm_service = LLMService()
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_llm_service() -> LLMService:
+    """Global LLM service instance, built on first use rather than at import"""
+    return LLMService()
\ No newline at end of file
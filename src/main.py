@@ -1,28 +1,105 @@
-from fastapi import FastAPI, Request, HTTPException, Query, Form, Body
-from pydantic import BaseModel
-from fastapi.responses import PlainTextResponse
-from typing import Optional
+from fastapi import FastAPI, Request, HTTPException, Query, Form, Body, BackgroundTasks
+from pydantic import BaseModel, ConfigDict
+from fastapi.responses import PlainTextResponse, JSONResponse, Response
+from typing import Optional, List, Tuple
 from dotenv import load_dotenv
 import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
 from .database import db
 from .twilio_handler import twilio_handler
 from .memory_service import memory_service
 from .utils import extract_query_intent
+from .llm_service import get_llm_service
 from datetime import datetime
-import json
+import orjson
+import hashlib
+import logging
+import logging.handlers
+import queue
+import re
+import time
+import uuid
 
 load_dotenv()
 
+# Question words that mark a message as a search query (substring match, like before)
+_QUERY_RE = re.compile(r'what|when|where|who|how|show me|find|which')
+_LIST_COMMANDS = frozenset({'/list', 'list'})
+
+# Response timestamp, reformatted at most once per second
+_ts_cache = (0, "")
+
+
+def _now_iso() -> str:
+    """Current local time as an ISO string, to the second"""
+    global _ts_cache
+    second = int(time.time())
+    if second != _ts_cache[0]:
+        _ts_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return _ts_cache[1]
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson"""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+def _etag_response(request: Request, payload: dict) -> Response:
+    """JSON response tagged with an ETag of the payload; 304 if the client already has it"""
+    # The timestamp changes every second, so leave it out of the tag
+    tagged = {key: value for key, value in payload.items() if key != "timestamp"}
+    etag = f'"{hashlib.blake2b(orjson.dumps(tagged), digest_size=8).hexdigest()}"'
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return ORJSONResponse(payload, headers={"ETag": etag})
+
 class MemoryCreate(BaseModel):
+    model_config = ConfigDict(extra='ignore', frozen=True)
+    
     content: str
     user_id: str
     content_type: str = "text"
     metadata: Optional[str] = None
 
+class MemoryBatchCreate(BaseModel):
+    model_config = ConfigDict(extra='ignore', frozen=True)
+    
+    items: List[MemoryCreate]
+
+def _start_log_listener() -> Tuple[logging.Handler, logging.handlers.QueueListener]:
+    """Route log records through a queue so handler I/O happens off the request path"""
+    log_queue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return handler, listener
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the LLM client off the import path; release pooled connections on shutdown"""
+    log_handler, log_listener = _start_log_listener()
+    await asyncio.to_thread(get_llm_service)
+    yield
+    log_listener.stop()
+    logging.getLogger().removeHandler(log_handler)
+    get_llm_service().close()
+    twilio_handler.media_processor.close()
+    memory_service.close()
+
 app = FastAPI(
     title="WhatsApp Memory Assistant",
     description="A WhatsApp chatbot with intelligent memory capabilities using Mem0",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 
@@ -37,24 +114,28 @@ async def root():
 
 
 @app.get("/health")
-async def health_check():
+async def health_check(request: Request):
     """Detailed health check"""
-    return {
+    return _etag_response(request, {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": _now_iso(),
         "services": {
             "database": "connected",
             "twilio": "configured",
             "mem0": "configured",
             "elevenlabs": "configured"
         }
-    }
+    })
 
 
 @app.post("/webhook")
-async def webhook(request: Request):
+async def webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Twilio webhook endpoint for receiving WhatsApp messages
+    
+    Media is downloaded and analyzed after the TwiML ack is sent, so slow
+    transcriptions can't run into Twilio's webhook timeout; the result
+    follows as a separate WhatsApp message.
     """
     try:
         # Get form data from Twilio webhook
@@ -68,21 +149,29 @@ async def webhook(request: Request):
         from_number = webhook_data.get('From', '')
         
         # Get user
-        clean_from = from_number.replace('whatsapp:', '')
-        user_id = db.create_user(phone_number=clean_from, whatsapp_id=from_number)
+        clean_from = from_number.removeprefix('whatsapp:')
+        user_id = await asyncio.to_thread(db.create_user, phone_number=clean_from, whatsapp_id=from_number)
         
         # Check if it's a search query (contains question words or ends with ?)
+        body_lower = body.lower()
         is_query = (
             body.endswith('?') or 
-            any(word in body.lower() for word in ['what', 'when', 'where', 'who', 'how', 'show me', 'find', 'which'])
-        ) and body.lower() not in ['/list', 'list']
+            _QUERY_RE.search(body_lower) is not None
+        ) and body_lower not in _LIST_COMMANDS
         
+        # Handlers block on DB, Mem0, LLM and media I/O; run them in a worker
+        # thread so concurrent webhooks don't serialize on the event loop
         if is_query:
             # Handle as search query
-            response_text = twilio_handler.search_and_respond(body, user_id)
+            response_text = await asyncio.to_thread(twilio_handler.search_and_respond, body, user_id)
         else:
             # Process as regular message/media
-            result = twilio_handler.process_webhook_message(webhook_data)
+            result = await asyncio.to_thread(twilio_handler.process_webhook_message, webhook_data, True)
+            if result.get('status') == 'queued':
+                background_tasks.add_task(
+                    twilio_handler.process_queued_media,
+                    result['message'], result['user_id'], result['message_type'], result['interaction_id']
+                )
             if result.get('status') == 'error':
                 response_text = result.get('response', f"❌ Error: {result.get('error', 'Unknown error occurred')}")
             else:
@@ -100,77 +189,152 @@ async def webhook(request: Request):
         return PlainTextResponse(content=error_response, media_type="application/xml")
 
 
+def _create_api_memory(memory: MemoryCreate) -> dict:
+    """Create a memory from an API request and record it in the database"""
+    # Parse metadata if provided
+    parsed_metadata = {}
+    if memory.metadata:
+        try:
+            parsed_metadata = orjson.loads(memory.metadata)
+        except orjson.JSONDecodeError:
+            parsed_metadata = {"raw_metadata": memory.metadata}
+    
+    # Add source info
+    parsed_metadata.update({
+        "source": "api",
+        "content_type": memory.content_type,
+        "timestamp": datetime.now().isoformat()
+    })
+    
+    # Create memory based on type
+    if memory.content_type == "text":
+        mem0_memory_id = memory_service.create_text_memory(
+            text=memory.content,
+            user_id=memory.user_id,
+            metadata=parsed_metadata
+        )
+    elif memory.content_type == "image":
+        mem0_memory_id = memory_service.create_image_memory(
+            image_path=memory.content,  # Assuming content is file path for images
+            user_id=memory.user_id,
+            metadata=parsed_metadata
+        )
+    else:
+        # Default to text memory
+        mem0_memory_id = memory_service.create_text_memory(
+            text=memory.content,
+            user_id=memory.user_id,
+            metadata=parsed_metadata
+        )
+    
+    return _record_api_memory(memory, mem0_memory_id, parsed_metadata)
+
+
+def _create_api_text_batch(user_id: str, memories: List[MemoryCreate]) -> List[dict]:
+    """Create plain text memories for one user with a single Mem0 call"""
+    metadata = {
+        "source": "api",
+        "content_type": "text",
+        "timestamp": datetime.now().isoformat()
+    }
+    mem0_memory_ids = memory_service.create_text_memories_batch(
+        [memory.content for memory in memories], user_id, metadata
+    )
+    return [
+        _record_api_memory(memory, mem0_memory_id, metadata)
+        for memory, mem0_memory_id in zip(memories, mem0_memory_ids)
+    ]
+
+
+def _record_api_memory(memory: MemoryCreate, mem0_memory_id: Optional[str], parsed_metadata: dict) -> dict:
+    """Record an API-created memory in the database"""
+    # Create dummy interaction record for API-created memories
+    interaction_id = db.create_interaction(
+        user_id=memory.user_id,
+        # Unique even when batch items are created in the same instant
+        twilio_message_sid=f"api_{uuid.uuid4().hex}",
+        message_type=memory.content_type,
+        content=memory.content
+    )
+    
+    # Save memory to database
+    db_memory_id = None
+    if mem0_memory_id:
+        db_memory_id = db.create_memory(
+            user_id=memory.user_id,
+            interaction_id=interaction_id,
+            mem0_memory_id=mem0_memory_id,
+            memory_content=memory.content,
+            tags=parsed_metadata.get("tags", [])
+        )
+    
+    return {
+        "status": "success",
+        "memory_id": mem0_memory_id,
+        "db_memory_id": db_memory_id,
+        "message": "Memory created successfully"
+    }
+
+
 @app.post("/memories")
 async def add_memory(memory: MemoryCreate):
     """
     Add a new memory manually
     """
     try:
-        # Parse metadata if provided
-        parsed_metadata = {}
-        if memory.metadata:
-            try:
-                parsed_metadata = json.loads(memory.metadata)
-            except json.JSONDecodeError:
-                parsed_metadata = {"raw_metadata": memory.metadata}
-        
-        # Add source info
-        parsed_metadata.update({
-            "source": "api",
-            "content_type": memory.content_type,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Create memory based on type
-        if memory.content_type == "text":
-            mem0_memory_id = memory_service.create_text_memory(
-                text=memory.content,
-                user_id=memory.user_id,
-                metadata=parsed_metadata
-            )
-        elif memory.content_type == "image":
-            mem0_memory_id = memory_service.create_image_memory(
-                image_path=memory.content,  # Assuming content is file path for images
-                user_id=memory.user_id,
-                metadata=parsed_metadata
-            )
-        else:
-            # Default to text memory
-            mem0_memory_id = memory_service.create_text_memory(
-                text=memory.content,
-                user_id=memory.user_id,
-                metadata=parsed_metadata
-            )
-        
-        # Create dummy interaction record for API-created memories
-        interaction_id = db.create_interaction(
-            user_id=memory.user_id,
-            twilio_message_sid=f"api_{datetime.now().timestamp()}",
-            message_type=memory.content_type,
-            content=memory.content
-        )
-        
-        # Save memory to database
-        if mem0_memory_id:
-            memory_id = db.create_memory(
-                user_id=memory.user_id,
-                interaction_id=interaction_id,
-                mem0_memory_id=mem0_memory_id,
-                memory_content=memory.content,
-                tags=parsed_metadata.get("tags", [])
-            )
-        
-        return {
-            "status": "success",
-            "memory_id": mem0_memory_id,
-            "db_memory_id": memory_id,
-            "message": "Memory created successfully"
-        }
+        return await asyncio.to_thread(_create_api_memory, memory)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating memory: {str(e)}")
 
 
+@app.post("/memories/batch")
+async def add_memories_batch(batch: MemoryBatchCreate):
+    """
+    Add several memories in one request; items are processed concurrently
+    
+    Plain text items without metadata are grouped per user into one Mem0 call.
+    """
+    async def create_item(item: MemoryCreate) -> dict:
+        try:
+            return await asyncio.to_thread(_create_api_memory, item)
+        except Exception as e:
+            return {"status": "error", "error": f"Error creating memory: {str(e)}"}
+    
+    async def create_group(user_id: str, items: List[MemoryCreate]) -> List[dict]:
+        try:
+            return await asyncio.to_thread(_create_api_text_batch, user_id, items)
+        except Exception as e:
+            return [{"status": "error", "error": f"Error creating memory: {str(e)}"}] * len(items)
+    
+    groups = {}
+    singles = []
+    for index, item in enumerate(batch.items):
+        if item.content_type == "text" and not item.metadata:
+            groups.setdefault(item.user_id, []).append(index)
+        else:
+            singles.append(index)
+    
+    group_results, single_results = await asyncio.gather(
+        asyncio.gather(*(create_group(user_id, [batch.items[i] for i in indexes]) for user_id, indexes in groups.items())),
+        asyncio.gather(*(create_item(batch.items[i]) for i in singles))
+    )
+    
+    # Put results back in request order
+    results = [None] * len(batch.items)
+    for indexes, outcomes in zip(groups.values(), group_results):
+        for index, outcome in zip(indexes, outcomes):
+            results[index] = outcome
+    for index, outcome in zip(singles, single_results):
+        results[index] = outcome
+    
+    return {
+        "results": results,
+        "total_count": len(results),
+        "success_count": sum(1 for result in results if result.get("status") == "success")
+    }
+
+
 @app.get("/memories")
 async def search_memories(
     query: str = Query(..., description="Search query"),
@@ -185,22 +349,17 @@ async def search_memories(
             raise HTTPException(status_code=400, detail="user_id is required for memory search")
         
         # Get user's timezone
-        user = db.get_user_by_id(user_id)
+        user = await asyncio.to_thread(db.get_user_by_id, user_id)
         user_timezone = user.get('timezone', 'UTC') if user else 'UTC'
         
         # Extract time entities from query
         query_intent = extract_query_intent(query)
-        time_entities = query_intent.get('time_entities', [])
-        
-        # Get database memories with timezone-aware filtering first
-        if time_entities:
-            db_memories = db.get_memories_for_user_with_time_filter(user_id, time_entities, user_timezone, limit=50)
-        else:
-            db_memories = db.get_memories_for_user(user_id, limit=50)
+        time_entities = query_intent.time_entities
         
         # Search using Mem0 with error handling, including time filtering
         try:
-            mem0_results = memory_service.search_memories(
+            mem0_results = await asyncio.to_thread(
+                memory_service.search_memories,
                 query=query, 
                 user_id=user_id, 
                 limit=limit,
@@ -211,30 +370,44 @@ async def search_memories(
             print(f"Mem0 search failed, falling back to database only: {e}")
             mem0_results = []
         
-        # Apply relevance threshold filter to improve result quality
+        # Apply relevance threshold filter to improve result quality, tracking
+        # the top result in the same pass
         relevance_threshold = 0.5  # Only return memories with score >= 0.5
-        filtered_mem0_results = [
-            result for result in mem0_results 
-            if result.get('score', 0) >= relevance_threshold
-        ]
+        filtered_mem0_results = []
+        top_result = None
+        for result in mem0_results:
+            score = result.get('score', 0)
+            if score >= relevance_threshold:
+                filtered_mem0_results.append(result)
+            if top_result is None or score > top_result.get('score', 0):
+                top_result = result
         
         # If no relevant results, return the top result if score >= 0.3 (more lenient)
-        if not filtered_mem0_results and mem0_results:
-            top_result = max(mem0_results, key=lambda x: x.get('score', 0))
+        if not filtered_mem0_results and top_result is not None:
             if top_result.get('score', 0) >= 0.3:
                 filtered_mem0_results = [top_result]
         
+        # Fetch only the DB records for the returned hits, same time window as Mem0
+        db_memories = await asyncio.to_thread(
+            db.get_memories_by_mem0_ids,
+            user_id,
+            [result.get('id', result.get('memory_id')) for result in filtered_mem0_results],
+            time_entities,
+            user_timezone
+        )
+        
+        # Index DB records by Mem0 id for O(1) matching
+        db_by_mem0_id = {}
+        for db_mem in db_memories:
+            db_by_mem0_id.setdefault(db_mem['mem0_memory_id'], db_mem)
+        
         # Enrich results with database information and enhanced formatting
         enriched_results = []
         for result in filtered_mem0_results:
             memory_id = result.get('id', result.get('memory_id'))
             
             # Find matching DB record
-            db_match = None
-            for db_mem in db_memories:
-                if db_mem['mem0_memory_id'] == memory_id:
-                    db_match = db_mem
-                    break
+            db_match = db_by_mem0_id.get(memory_id)
             
             # Enhanced content formatting with context
             raw_content = result.get('memory', result.get('content', ''))
@@ -284,7 +457,7 @@ async def search_memories(
                 "user_timezone": user_timezone,
                 "time_entities": time_entities,
                 "limit": limit,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": _now_iso()
             }
         }
         
@@ -294,6 +467,7 @@ async def search_memories(
 
 @app.get("/memories/list")
 async def list_memories(
+    request: Request,
     user_id: Optional[str] = Query(default=None, description="User ID"),
     limit: int = Query(default=50, description="Number of memories to return"),
     time_filter: Optional[str] = Query(default=None, description="Time filter (e.g., 'today', 'yesterday', 'last week')")
@@ -304,40 +478,42 @@ async def list_memories(
     try:
         if not user_id:
             # Return recent memories from all users
-            recent_interactions = db.get_recent_interactions(limit=limit)
-            memories = []
+            recent_interactions = await asyncio.to_thread(db.get_recent_interactions, limit=limit)
             
-            for interaction in recent_interactions:
-                user_memories = db.get_memories_for_user(interaction['user_id'], limit=5)
-                memories.extend(user_memories)
+            # Per-user memory lookups are independent; fetch them concurrently
+            user_memories = await asyncio.gather(*(
+                asyncio.to_thread(db.get_memories_for_user, interaction['user_id'], limit=5)
+                for interaction in recent_interactions
+            ))
+            memories = [memory for batch in user_memories for memory in batch]
         else:
             # Get user's timezone
-            user = db.get_user_by_id(user_id)
+            user = await asyncio.to_thread(db.get_user_by_id, user_id)
             user_timezone = user.get('timezone', 'UTC') if user else 'UTC'
             
             if time_filter:
                 # Extract time entities from the time filter
                 query_intent = extract_query_intent(time_filter)
-                time_entities = query_intent.get('time_entities', [])
+                time_entities = query_intent.time_entities
                 
                 if time_entities:
-                    memories = db.get_memories_for_user_with_time_filter(user_id, time_entities, user_timezone, limit)
+                    memories = await asyncio.to_thread(db.get_memories_for_user_with_time_filter, user_id, time_entities, user_timezone, limit)
                 else:
-                    memories = db.get_memories_for_user(user_id, limit)
+                    memories = await asyncio.to_thread(db.get_memories_for_user, user_id, limit)
             else:
-                memories = db.get_memories_for_user(user_id, limit)
+                memories = await asyncio.to_thread(db.get_memories_for_user, user_id, limit)
         
         # Sort by creation date
         memories.sort(key=lambda x: x['created_at'], reverse=True)
         
-        return {
+        return _etag_response(request, {
             "memories": memories[:limit],
             "total_count": len(memories),
             "user_id": user_id,
             "time_filter": time_filter,
             "user_timezone": user.get('timezone', 'UTC') if user_id and user else None,
-            "timestamp": datetime.now().isoformat()
-        }
+            "timestamp": _now_iso()
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing memories: {str(e)}")
@@ -352,7 +528,7 @@ async def get_recent_interactions(
     Get recent user interactions
     """
     try:
-        interactions = db.get_recent_interactions(user_id=user_id, limit=limit)
+        interactions = await asyncio.to_thread(db.get_recent_interactions, user_id=user_id, limit=limit)
         
         return {
             "interactions": interactions,
@@ -361,7 +537,7 @@ async def get_recent_interactions(
                 "user_id": user_id,
                 "limit": limit
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _now_iso()
         }
         
     except Exception as e:
@@ -369,23 +545,25 @@ async def get_recent_interactions(
 
 
 @app.get("/analytics/summary")
-async def get_analytics_summary():
+async def get_analytics_summary(request: Request):
     """
     Get analytics summary from database
     """
     try:
-        summary = db.get_analytics_summary()
+        summary = await asyncio.to_thread(db.get_analytics_summary)
         
         # Add some computed metrics
+        users = max(summary["total_users"], 1)
+        interactions = max(summary["total_interactions"], 1)
         summary["metrics"] = {
-            "avg_interactions_per_user": round(summary["total_interactions"] / max(summary["total_users"], 1), 2),
-            "avg_memories_per_user": round(summary["total_memories"] / max(summary["total_users"], 1), 2),
-            "memory_to_interaction_ratio": round(summary["total_memories"] / max(summary["total_interactions"], 1), 2)
+            "avg_interactions_per_user": round(summary["total_interactions"] / users, 2),
+            "avg_memories_per_user": round(summary["total_memories"] / users, 2),
+            "memory_to_interaction_ratio": round(summary["total_memories"] / interactions, 2)
         }
         
-        summary["timestamp"] = datetime.now().isoformat()
+        summary["timestamp"] = _now_iso()
         
-        return summary
+        return _etag_response(request, summary)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting analytics: {str(e)}")
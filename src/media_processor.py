@@ -1,15 +1,28 @@
 import hashlib
 import os
+import re
+import threading
+import uuid
 import requests
-from pathlib import Path
-from typing import Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pathlib import Path, PurePosixPath
+from typing import Dict, Optional, Tuple
 import mimetypes
+from collections import OrderedDict
 from elevenlabs.client import ElevenLabs
 from dotenv import load_dotenv
-from io import BytesIO
 
 load_dotenv()
 
+# Max remembered media ETags and in-memory transcripts
+ETAG_CACHE_SIZE = 4096
+TRANSCRIPT_CACHE_SIZE = 1024
+
+# Strong ETags that look like content digests (hex, optionally S3 multipart "-N",
+# or base64); weak validators and version-style tags don't identify content
+_DIGEST_ETAG_RE = re.compile(r'"(?:[0-9a-fA-F]{32,}(?:-\d+)?|[A-Za-z0-9+/_-]{22,}={0,2})"')
+
 
 class MediaProcessor:
     def __init__(self, media_dir: str = "./media"):
@@ -18,18 +31,89 @@ class MediaProcessor:
         (self.media_dir / "images").mkdir(exist_ok=True)
         (self.media_dir / "audio").mkdir(exist_ok=True)
         (self.media_dir / "transcripts").mkdir(exist_ok=True)
+        (self.media_dir / "tmp").mkdir(exist_ok=True)
         
         # Initialize ElevenLabs client for transcription
         self.elevenlabs_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
+        
+        # Keep-alive session so media downloads reuse TLS connections to Twilio
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=50,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=('GET', 'HEAD'))
+        ))
+        
+        # (ETag, Content-Length) -> content hash for media already downloaded, to skip repeat downloads
+        self._etag_hashes: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._etag_lock = threading.Lock()
+        
+        # Content hash -> transcript, in front of the transcripts/ directory
+        self._transcripts: "OrderedDict[str, str]" = OrderedDict()
+        self._transcript_lock = threading.Lock()
+    
+    def close(self) -> None:
+        """Close pooled download connections"""
+        self.session.close()
+    
+    def download_and_stage(self, media_url: str, twilio_auth: tuple,
+                           keep_content: bool = False) -> Tuple[Path, str, int, Optional[bytes]]:
+        """Stream media from Twilio to a temp file, hashing as it arrives
+        
+        Returns:
+            (temp file path, SHA256 hex digest, size in bytes, content if keep_content else None)
+        """
+        tmp_path = self.media_dir / "tmp" / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        size = 0
+        chunks = [] if keep_content else None
+        
+        try:
+            with self.session.get(media_url, auth=twilio_auth, stream=True, timeout=(3, 30)) as response:
+                response.raise_for_status()
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1 << 20):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                        if chunks is not None:
+                            chunks.append(chunk)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        
+        return tmp_path, digest.hexdigest(), size, b"".join(chunks) if chunks is not None else None
+    
+    def probe_etag(self, media_url: str, twilio_auth: tuple) -> Optional[Tuple[str, int]]:
+        """(ETag, Content-Length) of the media at media_url from a HEAD request
+        
+        None unless the response carries a strong, digest-like ETag and a length.
+        """
+        try:
+            response = self.session.head(media_url, auth=twilio_auth, allow_redirects=True, timeout=(3, 10))
+        except requests.RequestException as e:
+            print(f"Could not probe media ETag: {e}")
+            return None
+        if not response.ok:
+            return None
+        
+        etag = response.headers.get('ETag')
+        length = response.headers.get('Content-Length')
+        if not etag or not length or not length.isdigit() or not _DIGEST_ETAG_RE.fullmatch(etag):
+            return None
+        return etag, int(length)
     
-    def download_media(self, media_url: str, twilio_auth: tuple) -> bytes:
-        """Download media from Twilio URL"""
-        response = requests.get(media_url, auth=twilio_auth)
-        response.raise_for_status()
-        return response.content
+    def _remember_etag(self, etag: Tuple[str, int], content_hash: str) -> None:
+        """Map an (ETag, length) to the content hash it was downloaded as, evicting the oldest entry"""
+        with self._etag_lock:
+            self._etag_hashes[etag] = content_hash
+            self._etag_hashes.move_to_end(etag)
+            if len(self._etag_hashes) > ETAG_CACHE_SIZE:
+                self._etag_hashes.popitem(last=False)
     
     def get_content_hash(self, content: bytes) -> str:
-        """Generate SHA256 hash for content"""
+        """Generate SHA256 hash for in-memory content (downloads hash incrementally in download_and_stage)"""
         return hashlib.sha256(content).hexdigest()
     
     def get_file_extension(self, media_url: str, content_type: str = None) -> str:
@@ -39,27 +123,10 @@ class MediaProcessor:
             if ext:
                 return ext
         
-        # Fallback to URL extension
-        path = Path(media_url)
+        # Fallback to URL extension; URLs always use '/' so skip OS path handling
+        path = PurePosixPath(media_url)
         return path.suffix if path.suffix else '.bin'
     
-    def save_media_file(self, content: bytes, content_hash: str, media_type: str, 
-                       file_extension: str) -> str:
-        """Save media file to appropriate directory"""
-        if media_type == "image":
-            subdir = "images"
-        elif media_type == "audio":
-            subdir = "audio"
-        else:
-            subdir = "audio"  # Default for unknown types
-        
-        file_path = self.media_dir / subdir / f"{content_hash}{file_extension}"
-        
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        return str(file_path)
-    
     def transcribe_audio(self, audio_file_path: str) -> Optional[str]:
         """Transcribe audio file using ElevenLabs Speech-to-Text"""
         try:
@@ -67,33 +134,73 @@ class MediaProcessor:
                 print("ElevenLabs client not available")
                 return f"[Audio file: {os.path.basename(audio_file_path)}]"
             
-            # Read the audio file
-            with open(audio_file_path, "rb") as audio_file:
-                audio_data = BytesIO(audio_file.read())
-            
-            # Use ElevenLabs speech-to-text API
-            transcription = self.elevenlabs_client.speech_to_text.convert(
-                file=audio_data,
-                model_id="scribe_v1"  # Currently the only supported model
-            )
-            
-            # Extract just the text from the transcription response
-            if hasattr(transcription, 'text'):
-                return transcription.text.strip()
-            elif isinstance(transcription, dict) and 'text' in transcription:
-                return transcription['text'].strip()
-            elif isinstance(transcription, str):
-                return transcription.strip()
-            else:
-                # Try to extract text from complex response
-                text_content = str(transcription)
-                return text_content[:500] if text_content else None
+            return self._speech_to_text(audio_file_path)
                 
         except Exception as e:
             print(f"Error transcribing audio with ElevenLabs: {e}")
             # Fallback to filename-based description
             return f"[Voice message from {os.path.basename(audio_file_path)}]"
     
+    def transcribe_by_hash(self, content_hash: str, audio_file_path: str) -> Optional[str]:
+        """Transcribe audio, reusing any transcript already produced for the same content
+        
+        Transcripts are cached in memory and in transcripts/<hash>.txt; identical bytes
+        always give the same transcript, so repeats never reach ElevenLabs. Fallback
+        descriptions from failed transcriptions are returned but not cached.
+        """
+        with self._transcript_lock:
+            transcript = self._transcripts.get(content_hash)
+            if transcript is not None:
+                self._transcripts.move_to_end(content_hash)
+                return transcript
+        
+        transcript_path = self.media_dir / "transcripts" / f"{content_hash}.txt"
+        if transcript_path.exists():
+            transcript = transcript_path.read_text()
+        else:
+            if not self.elevenlabs_client:
+                return self.transcribe_audio(audio_file_path)
+            try:
+                transcript = self._speech_to_text(audio_file_path)
+            except Exception as e:
+                print(f"Error transcribing audio with ElevenLabs: {e}")
+                return f"[Voice message from {os.path.basename(audio_file_path)}]"
+            if not transcript:
+                return transcript
+            
+            # Write atomically so a concurrent reader never sees a partial transcript
+            tmp_path = transcript_path.with_suffix(f".{uuid.uuid4().hex}.part")
+            tmp_path.write_text(transcript)
+            os.replace(tmp_path, transcript_path)
+        
+        with self._transcript_lock:
+            self._transcripts[content_hash] = transcript
+            if len(self._transcripts) > TRANSCRIPT_CACHE_SIZE:
+                self._transcripts.popitem(last=False)
+        return transcript
+    
+    def _speech_to_text(self, audio_file_path: str) -> Optional[str]:
+        """Call ElevenLabs Speech-to-Text and extract the text; raises on API errors"""
+        # Hand the open file to ElevenLabs so the audio isn't copied into memory first
+        with open(audio_file_path, "rb") as audio_file:
+            transcription = self.elevenlabs_client.speech_to_text.convert(
+                file=audio_file,
+                model_id="scribe_v1"  # Currently the only supported model
+            )
+        
+        # Extract just the text from the transcription response
+        text = getattr(transcription, 'text', None)
+        if text is not None:
+            return text.strip()
+        elif isinstance(transcription, dict) and 'text' in transcription:
+            return transcription['text'].strip()
+        elif isinstance(transcription, str):
+            return transcription.strip()
+        else:
+            # Try to extract text from complex response
+            text_content = str(transcription)
+            return text_content[:500] if text_content else None
+    
     def process_media(self, media_url: str, message_type: str, twilio_auth: tuple, 
                      content_type: str = None) -> Dict[str, str]:
         """
@@ -103,11 +210,6 @@ class MediaProcessor:
             Dict with keys: file_path, content_hash, transcript (if audio)
         """
         try:
-            # Download media content
-            content = self.download_media(media_url, twilio_auth)
-            content_hash = self.get_content_hash(content)
-            
-            # Check for existing file (deduplication)
             file_extension = self.get_file_extension(media_url, content_type)
             
             if message_type == "image":
@@ -117,31 +219,63 @@ class MediaProcessor:
             else:
                 subdir = "audio"
             
-            expected_path = self.media_dir / subdir / f"{content_hash}{file_extension}"
+            # Forwarded media has the same ETag; if we've already stored it (and the
+            # stored file has the advertised size), skip the download
+            etag = self.probe_etag(media_url, twilio_auth)
+            known_hash = self._etag_hashes.get(etag) if etag else None
+            known_path = self.media_dir / subdir / f"{known_hash}{file_extension}" if known_hash else None
+            try:
+                deduplicated = known_path is not None and known_path.stat().st_size == etag[1]
+            except FileNotFoundError:
+                deduplicated = False
             
-            # If file doesn't exist, save it
-            if not expected_path.exists():
-                file_path = self.save_media_file(content, content_hash, message_type, file_extension)
+            if deduplicated:
+                content_hash, file_size, content = known_hash, etag[1], None
+                file_path = str(known_path)
             else:
+                # Stream media to disk; images are also kept in memory since the
+                # LLM call needs their bytes anyway, audio never is
+                tmp_path, content_hash, file_size, content = self.download_and_stage(
+                    media_url, twilio_auth, keep_content=message_type == "image"
+                )
+                
+                # Check for existing file (deduplication)
+                expected_path = self.media_dir / subdir / f"{content_hash}{file_extension}"
+                
+                # Publish the staged download; link() fails atomically if another
+                # worker already stored the same content, so there's no check-then-write race
+                try:
+                    os.link(tmp_path, expected_path)
+                except FileExistsError:
+                    pass
+                except OSError:
+                    # Filesystem without hard links; replace is still atomic
+                    os.replace(tmp_path, expected_path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
                 file_path = str(expected_path)
+                
+                if etag:
+                    self._remember_etag(etag, content_hash)
             
             result = {
                 "file_path": file_path,
                 "content_hash": content_hash,
-                "file_size": len(content),
+                "file_size": file_size,
                 "file_extension": file_extension
             }
             
-            # Transcribe audio files
+            # Hand downloaded image bytes onward so analysis doesn't re-read the file
+            if message_type == "image" and content is not None:
+                result["content"] = content
+            
+            # Transcribe audio files, reusing the stored transcript for known content
             if message_type == "audio":
-                transcript = self.transcribe_audio(file_path)
+                transcript = self.transcribe_by_hash(content_hash, file_path)
                 result["transcript"] = transcript
                 
-                # Save transcript to separate file
-                if transcript:
-                    transcript_path = self.media_dir / "transcripts" / f"{content_hash}.txt"
-                    with open(transcript_path, "w") as f:
-                        f.write(transcript)
+                transcript_path = self.media_dir / "transcripts" / f"{content_hash}.txt"
+                if transcript and transcript_path.exists():
                     result["transcript_path"] = str(transcript_path)
             
             return result
@@ -1,16 +1,74 @@
+import hashlib
 import os
-from typing import List, Dict, Any, Optional
+import httpx
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 from pathlib import Path
-from .llm_service import llm_service
-from datetime import datetime, timedelta
+from .llm_service import get_llm_service
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import pytz
 
 load_dotenv()
 
+# Searches give up well before the reader stops waiting (see twilio_handler)
+MEM0_SEARCH_TIMEOUT = 5.0  # seconds
+_SEARCH_HTTP_TIMEOUT = httpx.Timeout(MEM0_SEARCH_TIMEOUT, connect=2.0).as_dict()
+
+
+def _cap_search_timeout(request: httpx.Request) -> None:
+    """Tighten the per-request timeout on Mem0 search calls so pool workers are freed"""
+    if request.url.path.rstrip('/').endswith('/memories/search'):
+        request.extensions["timeout"] = _SEARCH_HTTP_TIMEOUT
+
+
+def _fallback_id(prefix: str, text: str, user_id: str) -> str:
+    """Stable placeholder memory id for when Mem0 doesn't return one"""
+    digest = hashlib.blake2b(
+        text.encode('utf-8', 'ignore'), key=user_id.encode('utf-8')[:64], digest_size=16
+    ).hexdigest()
+    return f"{prefix}_{digest}"
+
+
+def _result_list(results) -> List:
+    """Normalize a Mem0 response (a bare list or {'results': [...]}) to a list"""
+    cls = results.__class__
+    if cls is list:
+        return results
+    if cls is dict:
+        results = results.get('results')
+        if results.__class__ is list:
+            return results
+    return []
+
+
+def _first_memory(result):
+    """First memory object in a Mem0 add response, a single object, or None if empty"""
+    cls = result.__class__
+    if cls is dict:
+        if 'results' not in result:
+            return result
+        result = result['results']
+        cls = result.__class__
+    if cls is list:
+        return result[0] if result else None
+    return result
+
+
+def _extract_memory_id(result) -> Optional[str]:
+    """Memory id from a Mem0 add response, or None if it created nothing"""
+    memory = _first_memory(result)
+    if memory is None:
+        return None
+    if memory.__class__ is dict:
+        return memory.get('id', str(memory))
+    return str(memory)
+
 
 class MemoryService:
     def __init__(self):
+        self._http = None
+        
         # Initialize Mem0 client with new MemoryClient API
         try:
             from mem0 import MemoryClient
@@ -19,10 +77,17 @@ class MemoryService:
             mem0_project_id = os.getenv("MEM0_PROJECT_ID")
             
             if mem0_api_key and mem0_org_id and mem0_project_id:
+                # One pooled client so concurrent searches reuse warm connections
+                self._http = httpx.Client(
+                    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=30.0),
+                    timeout=httpx.Timeout(300.0, connect=5.0),
+                    event_hooks={"request": [_cap_search_timeout]}
+                )
                 self.memory = MemoryClient(
                     api_key=mem0_api_key,
                     org_id=mem0_org_id,
-                    project_id=mem0_project_id
+                    project_id=mem0_project_id,
+                    client=self._http
                 )
             else:
                 print("Warning: Mem0 credentials incomplete (need API_KEY, ORG_ID, PROJECT_ID)")
@@ -31,11 +96,16 @@ class MemoryService:
             print(f"Warning: Could not initialize Mem0: {e}")
             self.memory = None
     
+    def close(self) -> None:
+        """Close pooled HTTP connections"""
+        if self._http:
+            self._http.close()
+    
     def create_text_memory(self, text: str, user_id: str, metadata: Dict = None) -> str:
         """Create memory from text content"""
         if not self.memory:
             print(f"Warning: Mem0 not available, using fallback for text: {text[:50]}...")
-            return f"fallback_{hash(text + user_id)}"
+            return _fallback_id("fallback", text, user_id)
             
         try:
             result = self.memory.add(
@@ -47,46 +117,72 @@ class MemoryService:
                 version="v2"  # Use v2 API version
             )
             
-            # Handle response based on API documentation format
-            if isinstance(result, list) and len(result) > 0:
-                # Direct array response (as per documentation)
-                return result[0].get('id', str(result[0]))
-            elif isinstance(result, dict) and 'results' in result:
-                # SDK might wrap it in results
-                results = result['results']
-                if isinstance(results, list) and len(results) > 0:
-                    return results[0].get('id', str(results[0]))
-                else:
-                    print(f"Warning: Text memory creation returned empty results for user {user_id}")
-                    return f"empty_result_{hash(text + user_id)}"
-            elif isinstance(result, dict) and 'id' in result:
-                # Single object response
-                return result['id']
-            elif isinstance(result, dict):
-                return result.get('id', str(result))
-            else:
-                return str(result)
+            memory_id = _extract_memory_id(result)
+            if memory_id is None:
+                print(f"Warning: Text memory creation returned empty results for user {user_id}")
+                return _fallback_id("empty_result", text, user_id)
+            return memory_id
                 
         except Exception as e:
             print(f"Error creating text memory: {e}")
-            return f"error_{hash(text + user_id)}"
+            return _fallback_id("error", text, user_id)
+    
+    def create_text_memories_batch(self, texts: List[str], user_id: str, metadata: Dict = None) -> List[Optional[str]]:
+        """Create one memory per text with a single Mem0 call, ids in input order
+        
+        With infer=False Mem0 stores each message as its own memory. Falls back to
+        one call per text if the batch request fails or doesn't return one result
+        per text.
+        """
+        if not self.memory or len(texts) < 2:
+            return [self.create_text_memory(text, user_id, metadata) for text in texts]
+            
+        try:
+            result = self.memory.add(
+                messages=[{"role": "user", "content": text} for text in texts],
+                user_id=user_id,
+                metadata=metadata or {},
+                infer=False,
+                output_format="v1.1",
+                version="v2"
+            )
+            
+            results = _result_list(result)
+            if results and len(results) == len(texts):
+                return [_extract_memory_id(item) for item in results]
+            
+            # Without one result per text, ids can't be paired with their texts
+            print(f"Warning: Batch memory creation returned {len(results)} results for "
+                  f"{len(texts)} texts for user {user_id}, retrying individually")
+                
+        except Exception as e:
+            print(f"Error creating batch memories, retrying individually: {e}")
+        
+        return [self.create_text_memory(text, user_id, metadata) for text in texts]
     
-    def create_image_memory(self, image_path: str, user_id: str, metadata: Dict = None) -> Dict[str, str]:
+    def create_image_memory(self, image_path: str, user_id: str, metadata: Dict = None,
+                            caption: str = None, image_bytes: bytes = None,
+                            mime: str = None) -> Dict[str, str]:
         """Create memory from image by converting to descriptive text
         
+        Any caption is analyzed together with the image in the same LLM call.
+        Pass image_bytes if the image is already in memory to skip re-reading it.
+        
         Returns:
             Dict containing 'memory_id' and 'memory_content'
         """
         if not self.memory:
             print(f"Warning: Mem0 not available, using fallback for image: {image_path}")
             return {
-                "memory_id": f"fallback_{hash(image_path + user_id)}",
+                "memory_id": _fallback_id("fallback", image_path, user_id),
                 "memory_content": f"Image file: {Path(image_path).name}"
             }
             
         try:
             # Use combined LLM analysis for efficiency
-            analysis_result = llm_service.analyze_image_with_content_insights(image_path)
+            analysis_result = get_llm_service().analyze_all(
+                text=caption, image_path=image_path, image_bytes=image_bytes, mime=mime
+            )
             image_description = analysis_result.get("description", f"User shared an image file located at {image_path}")
             
             # Prepare the content for Mem0
@@ -121,28 +217,16 @@ class MemoryService:
             )
             
             # Handle response format
-            if isinstance(result, list) and len(result) > 0:
-                memory_obj = result[0]
-                memory_id = memory_obj.get('id', str(memory_obj))
-                memory_content = memory_obj.get('memory', image_description)
-                return {"memory_id": memory_id, "memory_content": memory_content}
-                
-            elif isinstance(result, dict) and 'results' in result:
-                results = result['results']
-                if isinstance(results, list) and len(results) > 0:
-                    memory_obj = results[0]
-                    memory_id = memory_obj.get('id', str(memory_obj))
-                    memory_content = memory_obj.get('memory', image_description)
-                    return {"memory_id": memory_id, "memory_content": memory_content}
-                    
-            elif isinstance(result, dict) and 'id' in result:
-                memory_id = result['id']
-                memory_content = result.get('memory', image_description)
-                return {"memory_id": memory_id, "memory_content": memory_content}
+            memory_obj = _first_memory(result)
+            if memory_obj.__class__ is dict:
+                return {
+                    "memory_id": memory_obj.get('id', str(memory_obj)),
+                    "memory_content": memory_obj.get('memory', image_description)
+                }
             
             # Fallback if no valid response
             return {
-                "memory_id": f"empty_result_{hash(image_path + user_id)}",
+                "memory_id": _fallback_id("empty_result", image_path, user_id),
                 "memory_content": image_description
             }
                 
@@ -161,7 +245,7 @@ class MemoryService:
         """Create memory from audio transcript"""
         if not self.memory:
             print(f"Warning: Mem0 not available, using fallback for audio: {transcript[:50]}...")
-            return f"fallback_{hash(transcript + user_id)}"
+            return _fallback_id("fallback", transcript, user_id)
             
         try:
             # Create memory from the transcript
@@ -181,29 +265,15 @@ class MemoryService:
                 version="v2"  # Use v2 API version
             )
             
-            # Handle response based on API documentation format
-            if isinstance(result, list) and len(result) > 0:
-                # Direct array response (as per documentation)
-                return result[0].get('id', str(result[0]))
-            elif isinstance(result, dict) and 'results' in result:
-                # SDK might wrap it in results
-                results = result['results']
-                if isinstance(results, list) and len(results) > 0:
-                    return results[0].get('id', str(results[0]))
-                else:
-                    print(f"Warning: Audio memory creation returned empty results for user {user_id}")
-                    return f"empty_result_{hash(transcript + user_id)}"
-            elif isinstance(result, dict) and 'id' in result:
-                # Single object response
-                return result['id']
-            elif isinstance(result, dict):
-                return result.get('id', str(result))
-            else:
-                return str(result)
+            memory_id = _extract_memory_id(result)
+            if memory_id is None:
+                print(f"Warning: Audio memory creation returned empty results for user {user_id}")
+                return _fallback_id("empty_result", transcript, user_id)
+            return memory_id
                 
         except Exception as e:
             print(f"Error creating audio memory: {e}")
-            return f"error_{hash(transcript + user_id)}"
+            return _fallback_id("error", transcript, user_id)
     
     def search_memories(self, query: str, user_id: str, limit: int = 10, time_entities: List[Dict] = None, user_timezone: str = 'UTC') -> List[Dict]:
         """Search memories using natural language query with optional time filtering"""
@@ -232,12 +302,7 @@ class MemoryService:
             )
             
             # Normalize the results format
-            if isinstance(results, list):
-                return results
-            elif isinstance(results, dict) and 'results' in results:
-                return results['results']
-            else:
-                return []
+            return _result_list(results)
                 
         except Exception as e:
             error_msg = str(e).lower()
@@ -268,12 +333,7 @@ class MemoryService:
                 output_format="v1.1"
             )
             
-            if isinstance(results, list):
-                return results
-            elif isinstance(results, dict) and 'results' in results:
-                return results['results']
-            else:
-                return []
+            return _result_list(results)
                 
         except Exception as e:
             print(f"Error getting all memories: {e}")
@@ -321,7 +381,7 @@ class MemoryService:
         """Analyze image and convert to descriptive text using LLM"""
         try:
             # Use LLM service for image analysis
-            description = llm_service.analyze_image(image_path)
+            description = get_llm_service().analyze_image(image_path)
             return description or f"Image file: {Path(image_path).name}"
             
         except Exception as e:
@@ -332,7 +392,7 @@ class MemoryService:
         """Extract insights and tags from content using LLM"""
         try:
             # Use LLM service for content insights
-            insights = llm_service.extract_content_insights(content, content_type, image_description)
+            insights = get_llm_service().extract_content_insights(content, content_type, image_description)
             
             # Add content type specific tags if not already present
             if content_type == "image" and "visual" not in insights.get("tags", []):
@@ -357,47 +417,26 @@ class MemoryService:
             return None
             
         try:
-            now = datetime.now(pytz.timezone(user_timezone))
-            
             # Use the first time entity for filtering
             time_entity = time_entities[0]
             entity_type = time_entity.get('type')
-            
-            if entity_type == 'today':
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                end_date = start_date + timedelta(days=1)
-            elif entity_type == 'yesterday':
-                end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-                start_date = end_date - timedelta(days=1)
-            elif entity_type == 'this_week':
-                days_since_monday = now.weekday()
-                start_date = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-                end_date = start_date + timedelta(days=7)
-            elif entity_type == 'last_week':
-                days_since_monday = now.weekday()
-                this_week_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-                start_date = this_week_start - timedelta(days=7)
-                end_date = this_week_start
-            elif entity_type == 'days_ago':
-                days = int(time_entity.get('value', 1))
-                end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-                start_date = end_date - timedelta(days=days)
-            elif entity_type == 'hours_ago':
-                hours = int(time_entity.get('value', 1))
-                end_date = now
-                start_date = end_date - timedelta(hours=hours)
-            elif entity_type == 'last_hours':
-                hours = int(time_entity.get('value', 1))
-                end_date = now
-                start_date = end_date - timedelta(hours=hours)
-            else:
-                # Fallback for unknown time types - last 24 hours
-                start_date = now - timedelta(days=1)
-                end_date = now
-            
-            # Convert to ISO format for mem0 API
-            start_iso = start_date.isoformat()
-            end_iso = end_date.isoformat()
+            # Rolling windows end at the current instant, so only the calendar
+            # windows (fixed for the whole local day) are cached
+            now = datetime.now(_tz(user_timezone))
+            window = _calendar_windows(user_timezone, now.date()).get(entity_type)
+            if window is None:
+                if entity_type == 'days_ago':
+                    end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+                    start_date = end_date - timedelta(days=int(time_entity.get('value', 1)))
+                elif entity_type in ('hours_ago', 'last_hours'):
+                    end_date = now
+                    start_date = now - timedelta(hours=int(time_entity.get('value', 1)))
+                else:
+                    # Fallback for unknown time types - last 24 hours
+                    end_date = now
+                    start_date = now - timedelta(days=1)
+                window = (start_date.isoformat(), end_date.isoformat())
+            start_iso, end_iso = window
             
             return {
                 "created_at": {
@@ -411,5 +450,26 @@ class MemoryService:
             return None
 
 
+@lru_cache(maxsize=None)
+def _tz(name: str):
+    """Cached pytz timezone lookup"""
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=1024)
+def _calendar_windows(user_timezone: str, local_date: date) -> Dict[str, Tuple[str, str]]:
+    """ISO day and week windows around a local date; the date is part of the key so they roll over at midnight"""
+    start_of_day = _tz(user_timezone).localize(datetime.combine(local_date, datetime.min.time()))
+    week_start = start_of_day - timedelta(days=local_date.weekday())
+    
+    windows = {
+        'today': (start_of_day, start_of_day + timedelta(days=1)),
+        'yesterday': (start_of_day - timedelta(days=1), start_of_day),
+        'this_week': (week_start, week_start + timedelta(days=7)),
+        'last_week': (week_start - timedelta(days=7), week_start),
+    }
+    return {name: (start.isoformat(), end.isoformat()) for name, (start, end) in windows.items()}
+
+
 # Global memory service instance
 memory_service = MemoryService()
\ No newline at end of file
@@ -1,9 +1,11 @@
 """
 SQLAlchemy models for WhatsApp Memory Assistant
 """
-from sqlalchemy import create_engine, Column, String, DateTime, Text, ForeignKey
+from sqlalchemy import create_engine, Column, String, DateTime, Text, ForeignKey, Index, JSON, LargeBinary
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
 import uuid
 from datetime import datetime
 
@@ -15,10 +17,65 @@ def generate_uuid():
     return str(uuid.uuid4())
 
 
+class UUIDKey(TypeDecorator):
+    """UUID stored in 16 bytes (native uuid on Postgres, BLOB elsewhere), exposed as str
+    
+    Strings that aren't UUIDs are stored as their UTF-8 bytes, so lookups by a
+    malformed id simply match nothing.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+    
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        try:
+            return uuid.UUID(str(value)).bytes
+        except ValueError:
+            return str(value).encode('utf-8')
+    
+    def process_result_value(self, value, dialect):
+        if not isinstance(value, bytes):
+            return value
+        if len(value) == 16:
+            return str(uuid.UUID(bytes=value))
+        return value.decode('utf-8')
+
+
+def hex_to_digest(value: str) -> bytes:
+    """Raw bytes of a hex digest (non-hex strings fall back to their UTF-8 bytes)"""
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return str(value).encode('utf-8')
+
+
+class HexDigest(TypeDecorator):
+    """SHA-256 digest stored as its 32 raw bytes, exposed as a hex string"""
+    impl = LargeBinary(32)
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return hex_to_digest(value)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        value = bytes(value)
+        return value.hex() if len(value) == 32 else value.decode('utf-8')
+
+
 class User(Base):
     __tablename__ = 'users'
     
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
     phone_number = Column(String, unique=True, nullable=False, index=True)
     whatsapp_id = Column(String, unique=True, nullable=False)
     timezone = Column(String, default='UTC')
@@ -36,17 +93,24 @@ class User(Base):
 class Interaction(Base):
     __tablename__ = 'interactions'
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String, ForeignKey('users.id'), nullable=False)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    user_id = Column(UUIDKey, ForeignKey('users.id'), nullable=False)
     twilio_message_sid = Column(String, unique=True, nullable=False, index=True)
     message_type = Column(String, nullable=False)  # 'text', 'image', 'audio'
     content = Column(Text)
     media_url = Column(String)  # Original Twilio media URL
     media_file_path = Column(String)  # Local file path
-    media_content_hash = Column(String, index=True)  # For deduplication
+    media_content_hash = Column(HexDigest)  # For deduplication
     transcript = Column(Text)  # For audio messages
     created_at = Column(DateTime, default=func.now(), index=True)
     
+    __table_args__ = (
+        # Per-user recent interactions: walk the index in order and stop at LIMIT
+        Index("ix_interaction_user_created", user_id, created_at.desc()),
+        # Dedup lookup by hash returns the file path straight from the index
+        Index("ix_interaction_hash_path", media_content_hash, media_file_path),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="interactions")
     memories = relationship("Memory", back_populates="interaction")
@@ -58,14 +122,21 @@ class Interaction(Base):
 class Memory(Base):
     __tablename__ = 'memories'
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    user_id = Column(String, ForeignKey('users.id'), nullable=False)
-    interaction_id = Column(String, ForeignKey('interactions.id'), nullable=False)
+    id = Column(UUIDKey, primary_key=True, default=generate_uuid)
+    user_id = Column(UUIDKey, ForeignKey('users.id'), nullable=False)
+    interaction_id = Column(UUIDKey, ForeignKey('interactions.id'), nullable=False)
     mem0_memory_id = Column(String)  # Mem0's memory ID
     memory_content = Column(Text, nullable=False)
-    tags = Column(Text)  # JSON array as text
+    tags = Column(JSON(none_as_null=True))  # JSON array of tag strings
     created_at = Column(DateTime, default=func.now(), index=True)
     
+    __table_args__ = (
+        # Per-user memory listing, newest first
+        Index("ix_memory_user_created", user_id, created_at.desc()),
+        # Matching search hits back to their rows
+        Index("ix_memory_user_mem0", user_id, mem0_memory_id),
+    )
+    
     # Relationships
     user = relationship("User", back_populates="memories")
     interaction = relationship("Interaction", back_populates="memories")
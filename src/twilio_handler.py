@@ -1,111 +1,272 @@
+import logging
 import os
-from typing import Dict, Optional
+import re
+import threading
+from dataclasses import dataclass
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
 from twilio.twiml.messaging_response import MessagingResponse
 import requests
 from dotenv import load_dotenv
 from .database import db
 from .media_processor import MediaProcessor
-from .memory_service import memory_service
+from .memory_service import MEM0_SEARCH_TIMEOUT, memory_service
 from .utils import extract_query_intent
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Runs Mem0 searches concurrently with the database half of a query
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mem0-search")
+
+# Outbound WhatsApp sends, so callers don't wait on the Twilio round trip
+_send_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="wa-send")
+WHATSAPP_SEND_ATTEMPTS = 3
+_RETRYABLE_SEND_STATUS = {429, 500, 502, 503, 504}
+
+# (user_id, normalized query, memory version) -> (monotonic timestamp, reply),
+# so users re-sending the same question get an instant answer
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TTL = 30  # seconds
+_query_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+_SEARCH_ERROR_REPLY = "❌ Sorry, I had trouble searching your memories. Please try again."
+
+# Containers inject credentials directly; only local runs need the .env read
+if not os.getenv("TWILIO_ACCOUNT_SID"):
+    load_dotenv()
+
+# Read once at import, not per TwilioHandler instance
+_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+_WHATSAPP_NUMBER = os.getenv("TWILIO_WHATSAPP_NUMBER")
+
+_LIST_COMMANDS = frozenset({'/list', 'list'})
+
+# Rows rendered into replies, so queries fetch no more than that
+LIST_REPLY_SIZE = 10
+DB_REPLY_SIZE = 5
+
+# Short acknowledgements aren't worth an LLM call for tags
+TRIVIAL_TEXT_LENGTH = 8
+_TRIVIAL_REPLIES = frozenset({
+    'ok', 'okay', 'k', 'yes', 'yep', 'yeah', 'no', 'nope', 'thanks', 'thank you',
+    'thx', 'cool', 'nice', 'great', 'sure', 'got it', 'lol', 'hi', 'hello', 'bye'
+})
+
+
+# Placeholder ids memory_service returns when Mem0 didn't store anything, or a stringified dict
+_INVALID_MEM0_ID_RE = re.compile(r'fallback_|error_|empty_result_|\{')
+
+# Search reply decoration: emoji per content type, and tags too generic to show
+_TYPE_EMOJI = {'image': '📸', 'audio': '🎤', 'text': '💬'}
+_GENERIC_TAGS = frozenset({'general', 'text', 'voice', 'visual'})
+
+
+def _is_valid_mem0_id(memory_id) -> bool:
+    """True for a real Mem0 id (not a placeholder or a stringified dict)"""
+    return isinstance(memory_id, str) and not _INVALID_MEM0_ID_RE.match(memory_id)
+
+
+def _truncate(text: str, limit: int) -> str:
+    """Cut text to limit characters, marking the cut with an ellipsis"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _format_mem0_results(results: List[Dict], db_by_mem0_id: Dict[str, Dict]) -> Iterator[str]:
+    """Yield one formatted reply block per Mem0 result (top 3)"""
+    for i, result in enumerate(results[:3], 1):
+        memory_text = result.get('memory', result.get('content', str(result)))
+        metadata = result.get('metadata', {})
+        
+        # Add content type emoji and source info
+        content_type = metadata.get('content_type', 'text')
+        source = metadata.get('source', '')
+        type_emoji = _TYPE_EMOJI.get(content_type, '💬')
+        
+        # Find matching DB record for date info
+        memory_id = result.get('id', result.get('memory_id'))
+        db_match = db_by_mem0_id.get(memory_id)
+        
+        # Add date/source context
+        if db_match and db_match.get('interaction_date'):
+            date_str = db_match['interaction_date'].strftime('%Y-%m-%d')
+            source_info = f" ({date_str})"
+        elif source:
+            source_info = f" (from {source})"
+        else:
+            source_info = ""
+        
+        # Add tags if available for extra context
+        tags = []
+        if 'insights' in metadata and 'tags' in metadata['insights']:
+            tags = metadata['insights']['tags']
+        elif 'tags' in metadata:
+            tags = metadata['tags']
+        
+        # Format tags nicely
+        tag_info = ""
+        if tags:
+            relevant_tags = [tag for tag in tags[:3] if tag not in _GENERIC_TAGS]
+            if relevant_tags:
+                tag_info = f"\n   🏷️ Tags: {', '.join(relevant_tags)}"
+        
+        # Don't truncate - show full memory text
+        # Just clean up any extra whitespace
+        memory_text = memory_text.strip()
+        
+        yield f"{i}. {type_emoji} {memory_text}{source_info}{tag_info}\n\n"
+
+
+@dataclass(slots=True, frozen=True)
+class WebhookMessage:
+    """The fields of a Twilio webhook the handlers use, parsed once"""
+    from_number: str
+    to_number: str
+    message_sid: str
+    body: str
+    num_media: int
+    media_url: str
+    media_content_type: str
+    message_type: str
+    
+    @classmethod
+    def from_webhook(cls, webhook_data: Dict) -> "WebhookMessage":
+        num_media = int(webhook_data.get('NumMedia', 0))
+        media_content_type = webhook_data.get('MediaContentType0', '')
+        
+        if num_media == 0:
+            message_type = 'text'
+        elif media_content_type.startswith('image/'):
+            message_type = 'image'
+        elif media_content_type.startswith('audio/'):
+            message_type = 'audio'
+        else:
+            message_type = 'media'  # Generic media
+        
+        return cls(
+            from_number=webhook_data.get('From', ''),
+            to_number=webhook_data.get('To', ''),
+            message_sid=webhook_data.get('MessageSid', ''),
+            body=webhook_data.get('Body', ''),
+            num_media=num_media,
+            media_url=webhook_data.get('MediaUrl0', ''),
+            media_content_type=media_content_type,
+            message_type=message_type
+        )
 
 
 class TwilioHandler:
     def __init__(self):
-        self.account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-        self.auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-        self.whatsapp_number = os.getenv("TWILIO_WHATSAPP_NUMBER")
+        self.account_sid = _ACCOUNT_SID
+        self.auth_token = _AUTH_TOKEN
+        self.whatsapp_number = _WHATSAPP_NUMBER
         
-        self.client = Client(self.account_sid, self.auth_token)
         self.media_processor = MediaProcessor()
         
+        # REST calls and media downloads both go to api.twilio.com; share the
+        # media processor's keep-alive pool so outbound messages reuse warm connections
+        http_client = TwilioHttpClient(pool_connections=False, timeout=15)
+        http_client.session = self.media_processor.session
+        self.client = Client(self.account_sid, self.auth_token, http_client=http_client)
+        
     def get_twilio_auth(self) -> tuple:
         """Get Twilio auth tuple for media downloads"""
         return (self.account_sid, self.auth_token)
     
     def detect_message_type(self, webhook_data: Dict) -> str:
         """Detect message type from webhook data"""
-        num_media = int(webhook_data.get('NumMedia', 0))
-        
-        if num_media > 0:
-            # Check media type
-            media_content_type = webhook_data.get('MediaContentType0', '')
-            if media_content_type.startswith('image/'):
-                return 'image'
-            elif media_content_type.startswith('audio/'):
-                return 'audio'
-            else:
-                return 'media'  # Generic media
-        else:
-            return 'text'
+        return WebhookMessage.from_webhook(webhook_data).message_type
     
-    def process_webhook_message(self, webhook_data: Dict) -> Dict:
-        """Process incoming webhook message"""
+    def process_webhook_message(self, webhook_data: Dict, defer_media: bool = False) -> Dict:
+        """Process incoming webhook message
+        
+        With defer_media, image/audio messages only get their interaction recorded
+        and come back as "queued"; finish them with process_queued_media.
+        """
         try:
-            # Extract basic message info
-            from_number = webhook_data.get('From', '')
-            to_number = webhook_data.get('To', '')
-            message_sid = webhook_data.get('MessageSid', '')
-            body = webhook_data.get('Body', '')
+            # Extract basic message info once; handlers below take the parsed message
+            msg = WebhookMessage.from_webhook(webhook_data)
             
             # Clean phone numbers (remove whatsapp: prefix)
-            clean_from = from_number.replace('whatsapp:', '')
-            clean_to = to_number.replace('whatsapp:', '')
+            clean_from = msg.from_number.removeprefix('whatsapp:')
             
             # Get or create user
             user_id = db.create_user(
                 phone_number=clean_from,
-                whatsapp_id=from_number
+                whatsapp_id=msg.from_number
             )
             
-            # Check if message already processed (idempotency)
-            existing_interaction = db.get_interaction_by_sid(message_sid)
-            if existing_interaction:
+            # Record the interaction up front; the insert is also the idempotency check
+            message_type = msg.message_type
+            interaction_id = db.claim_interaction(
+                user_id=user_id,
+                twilio_message_sid=msg.message_sid,
+                message_type=message_type,
+                content=msg.body,
+                media_url=msg.media_url or None
+            )
+            if interaction_id is None:
+                existing_interaction = db.get_interaction_by_sid(msg.message_sid)
                 return {
                     "status": "already_processed",
-                    "interaction_id": existing_interaction['id'],
+                    "interaction_id": existing_interaction['id'] if existing_interaction else None,
                     "user_id": user_id
                 }
             
-            # Detect message type
-            message_type = self.detect_message_type(webhook_data)
-            
             # Process based on message type
             if message_type == 'text':
-                return self.process_text_message(webhook_data, user_id)
+                return self.process_text_message(msg, user_id, interaction_id)
+            elif defer_media:
+                return {
+                    "status": "queued",
+                    "message": msg,
+                    "message_type": message_type,
+                    "interaction_id": interaction_id,
+                    "user_id": user_id,
+                    "response": f"⏳ Got your {message_type}, processing it now..."
+                }
             elif message_type in ['image', 'audio']:
-                return self.process_media_message(webhook_data, user_id, message_type)
+                return self.process_media_message(msg, user_id, message_type, interaction_id)
             else:
-                return self.process_generic_media(webhook_data, user_id)
+                return self.process_generic_media(msg, user_id, interaction_id)
                 
         except Exception as e:
-            print(f"Error processing webhook message: {e}")
+            logger.exception("Error processing webhook message")
             return {
                 "status": "error",
                 "error": str(e)
             }
     
-    def process_text_message(self, webhook_data: Dict, user_id: str) -> Dict:
+    def process_text_message(self, msg: WebhookMessage, user_id: str,
+                             interaction_id: Optional[str] = None) -> Dict:
         """Process text message"""
-        message_sid = webhook_data.get('MessageSid', '')
-        body = webhook_data.get('Body', '')
+        body = msg.body
         
-        # Create interaction record
-        interaction_id = db.create_interaction(
-            user_id=user_id,
-            twilio_message_sid=message_sid,
-            message_type='text',
-            content=body
-        )
+        # Create interaction record unless the caller already has
+        if interaction_id is None:
+            interaction_id = db.create_interaction(
+                user_id=user_id,
+                twilio_message_sid=msg.message_sid,
+                message_type='text',
+                content=body
+            )
         
         # Check for special commands
-        if body.lower().strip() in ['/list', 'list']:
+        normalized = body.strip().lower()
+        if normalized in _LIST_COMMANDS:
             return self.handle_list_command(user_id, interaction_id)
         
-        # Create memory from text
-        insights = memory_service.extract_content_insights(body, 'text')
+        # Create memory from text; trivial messages skip insight extraction
+        if len(normalized) < TRIVIAL_TEXT_LENGTH or normalized in _TRIVIAL_REPLIES:
+            insights = {"tags": [], "category": "general", "sentiment": "neutral"}
+        else:
+            insights = memory_service.extract_content_insights(body, 'text')
         mem0_memory_id = memory_service.create_text_memory(
             text=body,
             user_id=user_id,
@@ -134,44 +295,57 @@ class TwilioHandler:
             "response": "Got it! I've saved your message to memory. 📝"
         }
     
-    def process_media_message(self, webhook_data: Dict, user_id: str, message_type: str) -> Dict:
+    def process_queued_media(self, msg: WebhookMessage, user_id: str, message_type: str,
+                             interaction_id: str) -> None:
+        """Finish a deferred media message and send the outcome as a follow-up WhatsApp message"""
+        result = self.process_media_message(msg, user_id, message_type, interaction_id)
+        response_text = result.get('response', f"❌ Error: {result.get('error', 'Unknown error occurred')}")
+        self.queue_whatsapp_message(msg.from_number, response_text)
+    
+    def process_media_message(self, msg: WebhookMessage, user_id: str, message_type: str,
+                              interaction_id: Optional[str] = None) -> Dict:
         """Process media messages with comprehensive error handling"""
         try:
-            return self._process_media_message_impl(webhook_data, user_id, message_type)
+            return self._process_media_message_impl(msg, user_id, message_type, interaction_id)
         except Exception as e:
-            print(f"Error processing media message: {e}")
+            logger.exception("Error processing media message")
             return {
                 "status": "error",
                 "error": str(e),
                 "response": f"🔄 I received your {message_type} but encountered an issue. Let me try again."
             }
     
-    def _process_media_message_impl(self, webhook_data: Dict, user_id: str, message_type: str) -> Dict:
+    def _create_media_interaction(self, msg: WebhookMessage, user_id: str, message_type: str) -> str:
+        """Record a media interaction before its media is processed"""
+        return db.create_interaction(
+            user_id=user_id,
+            twilio_message_sid=msg.message_sid,
+            message_type=message_type,
+            content=msg.body,
+            media_url=msg.media_url,
+            media_file_path=None,  # Will update later
+            media_content_hash=None,  # Will update later
+            transcript=None  # Will update later
+        )
+    
+    def _process_media_message_impl(self, msg: WebhookMessage, user_id: str, message_type: str,
+                                    interaction_id: Optional[str] = None) -> Dict:
         """Process image or audio message"""
-        message_sid = webhook_data.get('MessageSid', '')
-        media_url = webhook_data.get('MediaUrl0', '')
-        media_content_type = webhook_data.get('MediaContentType0', '')
-        caption = webhook_data.get('Body', '')
+        media_url = msg.media_url
+        media_content_type = msg.media_content_type
+        caption = msg.body
         
         # Create interaction record FIRST to avoid holding DB lock during processing
-        try:
-            interaction_id = db.create_interaction(
-                user_id=user_id,
-                twilio_message_sid=message_sid,
-                message_type=message_type,
-                content=caption,
-                media_url=media_url,
-                media_file_path=None,  # Will update later
-                media_content_hash=None,  # Will update later
-                transcript=None  # Will update later
-            )
-        except Exception as e:
-            print(f"Error creating interaction: {e}")
-            return {
-                "status": "error", 
-                "error": f"Database error: {str(e)}",
-                "response": "❌ Sorry, I encountered a database error. Please try again."
-            }
+        if interaction_id is None:
+            try:
+                interaction_id = self._create_media_interaction(msg, user_id, message_type)
+            except Exception as e:
+                logger.exception("Error creating interaction")
+                return {
+                    "status": "error", 
+                    "error": f"Database error: {str(e)}",
+                    "response": "❌ Sorry, I encountered a database error. Please try again."
+                }
         
         # Now process media file (this can take time)
         media_result = self.media_processor.process_media(
@@ -195,8 +369,8 @@ class TwilioHandler:
                 media_content_hash=media_result.get('content_hash'),
                 transcript=media_result.get('transcript')
             )
-        except Exception as e:
-            print(f"Error updating interaction: {e}")
+        except Exception:
+            logger.exception("Error updating interaction")
             # Continue processing even if update fails
         
         if message_type == 'image':
@@ -209,7 +383,10 @@ class TwilioHandler:
                     "message_type": "image",
                     "file_path": media_result['file_path'],
                     "content_hash": media_result['content_hash']
-                }
+                },
+                caption=caption,
+                image_bytes=media_result.get('content'),
+                mime=media_content_type or None
             )
             
             # Extract memory_id and memory_content from result
@@ -223,9 +400,7 @@ class TwilioHandler:
                 memory_content = base_memory_content
             
             # Set response based on memory creation success
-            if (isinstance(mem0_memory_id, str) and 
-                not mem0_memory_id.startswith(('fallback_', 'error_', 'empty_result_')) and
-                not mem0_memory_id.startswith('{')):
+            if _is_valid_mem0_id(mem0_memory_id):
                 response_msg = "📸 I've saved your image to memory!"
             else:
                 response_msg = "📸 I received your image but had trouble saving it to memory. The image is stored safely."
@@ -263,13 +438,7 @@ class TwilioHandler:
         # Save memory to database - but only if we have a valid memory ID
         if mem0_memory_id and interaction_id:
             # Check if we have a valid memory ID (not an error/empty result)
-            is_valid_memory_id = (
-                isinstance(mem0_memory_id, str) and 
-                not mem0_memory_id.startswith(('fallback_', 'error_', 'empty_result_')) and
-                not mem0_memory_id.startswith('{')  # Not a stringified dict
-            )
-            
-            if is_valid_memory_id:
+            if _is_valid_mem0_id(mem0_memory_id):
                 try:
                     tags = insights.get("tags", []) if message_type == 'audio' and 'insights' in locals() else []
                     db.create_memory(
@@ -279,10 +448,10 @@ class TwilioHandler:
                         memory_content=memory_content,
                         tags=tags
                     )
-                except Exception as e:
-                    print(f"Error creating memory record: {e}")
+                except Exception:
+                    logger.exception("Error creating memory record")
             else:
-                print(f"Warning: Skipping database storage - invalid memory ID: {mem0_memory_id}")
+                logger.warning("Skipping database storage - invalid memory ID: %s", mem0_memory_id)
         
         return {
             "status": "processed",
@@ -294,30 +463,32 @@ class TwilioHandler:
             "response": response_msg
         }
     
-    def process_generic_media(self, webhook_data: Dict, user_id: str) -> Dict:
+    def process_generic_media(self, msg: WebhookMessage, user_id: str,
+                              interaction_id: Optional[str] = None) -> Dict:
         """Process generic media (fallback)"""
         # Similar to media processing but more generic
-        return self.process_media_message(webhook_data, user_id, 'media')
+        return self.process_media_message(msg, user_id, 'media', interaction_id)
     
     def handle_list_command(self, user_id: str, interaction_id: str) -> Dict:
         """Handle /list command to show all memories"""
-        memories = db.get_memories_for_user(user_id, limit=20)
+        # One past what's shown, to know whether there are more
+        memories = db.get_memories_for_user(user_id, limit=LIST_REPLY_SIZE + 1)
         
         if not memories:
             response = "🗂️ You don't have any memories saved yet. Send me some messages, images, or voice notes!"
         else:
-            response = f"🗂️ Your Recent Memories ({len(memories)} total):\n\n"
-            for i, memory in enumerate(memories[:10], 1):
-                content = memory['memory_content']
-                # Truncate long content
-                if len(content) > 80:
-                    content = content[:80] + "..."
-                
-                date_str = memory['created_at'][:10]  # Just the date part
-                response += f"{i}. {content} ({date_str})\n"
+            shown = memories[:LIST_REPLY_SIZE]
+            total = f"{len(shown)}+" if len(memories) > LIST_REPLY_SIZE else f"{len(shown)}"
+            parts = [f"🗂️ Your Recent Memories ({total} total):\n\n"]
+            parts.extend(
+                # Truncate long content; just the date part of the timestamp
+                f"{i}. {_truncate(memory['memory_content'], 80)} ({memory['created_at'].strftime('%Y-%m-%d')})\n"
+                for i, memory in enumerate(shown, 1)
+            )
             
-            if len(memories) > 10:
-                response += f"\n... and {len(memories) - 10} more memories."
+            if len(memories) > LIST_REPLY_SIZE:
+                parts.append("\n... and more memories.")
+            response = "".join(parts)
         
         return {
             "status": "processed",
@@ -327,149 +498,147 @@ class TwilioHandler:
         }
     
     def search_and_respond(self, query: str, user_id: str) -> str:
+        """Search memories and create response, reusing the answer to a just-repeated query"""
+        # The memory version in the key drops cached answers once the user saves something new
+        key = (user_id, query.strip().lower(), db.memory_version(user_id))
+        now = time.monotonic()
+        with _query_cache_lock:
+            entry = _query_cache.get(key)
+            if entry is not None and now - entry[0] < QUERY_CACHE_TTL:
+                return entry[1]
+        
+        response = self._search_and_respond(query, user_id)
+        if response is not _SEARCH_ERROR_REPLY:
+            with _query_cache_lock:
+                _query_cache[key] = (now, response)
+                _query_cache.move_to_end(key)
+                if len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        return response
+    
+    def _search_and_respond(self, query: str, user_id: str) -> str:
         """Search memories and create response with timezone-aware filtering"""
         try:
             # Extract query intent and time entities
             query_intent = extract_query_intent(query)
-            time_entities = query_intent.get('time_entities', [])
+            time_entities = query_intent.time_entities
             
             # Get user's timezone from database
             user = db.get_user_by_id(user_id)
             user_timezone = user.get('timezone', 'UTC') if user else 'UTC'
             
-            # Get database memories with timezone-aware filtering first
+            # Run the Mem0 search alongside the database query instead of after it
             if time_entities:
-                db_memories = db.get_memories_for_user_with_time_filter(user_id, time_entities, user_timezone, limit=50)
-                
-                # Now try mem0 search with time filtering as well
-                print(f"Time-filtered query detected, trying both mem0 and database search for: {[e['type'] for e in time_entities]}")
-                try:
-                    mem0_results = memory_service.search_memories(
-                        query=query, 
-                        user_id=user_id, 
-                        limit=5,
-                        time_entities=time_entities,
-                        user_timezone=user_timezone
-                    )
-                except Exception as e:
-                    print(f"Mem0 time-filtered search failed, using database only: {e}")
-                    mem0_results = []
+                logger.debug("Time-filtered query detected, trying both mem0 and database search for: %s", [e['type'] for e in time_entities])
+                mem0_future = _search_pool.submit(
+                    memory_service.search_memories,
+                    query=query, 
+                    user_id=user_id, 
+                    limit=5,
+                    time_entities=time_entities,
+                    user_timezone=user_timezone
+                )
+                db_memories = db.get_memories_for_user_with_time_filter(user_id, time_entities, user_timezone, limit=DB_REPLY_SIZE)
             else:
-                db_memories = db.get_memories_for_user(user_id, limit=50)
                 # For non-time queries, try mem0 search normally
-                mem0_results = memory_service.search_memories(query, user_id, limit=5)
+                mem0_future = _search_pool.submit(memory_service.search_memories, query, user_id, limit=5)
+                db_memories = db.get_memories_for_user(user_id, limit=DB_REPLY_SIZE)
+            
+            # A slow Mem0 shouldn't hold the WhatsApp reply; answer from the DB instead
+            try:
+                mem0_results = mem0_future.result(timeout=MEM0_SEARCH_TIMEOUT)
+            except Exception as e:
+                # Drop the search if it is still queued so it doesn't hold a worker
+                mem0_future.cancel()
+                logger.warning("Mem0 search failed or timed out, using database only: %r", e)
+                mem0_results = []
             
-            # Apply relevance threshold filter to improve result quality (same as API)
+            # Apply relevance threshold filter to improve result quality (same as API),
+            # tracking the top result in the same pass
             relevance_threshold = 0.5  # Only return memories with score >= 0.5
-            filtered_mem0_results = [
-                result for result in mem0_results 
-                if result.get('score', 0) >= relevance_threshold
-            ]
+            filtered_mem0_results = []
+            top_result, top_score = None, None
+            for result in mem0_results:
+                score = result.get('score', 0)
+                if score >= relevance_threshold:
+                    filtered_mem0_results.append(result)
+                if top_score is None or score > top_score:
+                    top_result, top_score = result, score
             
             # If no relevant results, return the top result if score >= 0.3 (more lenient)
-            if not filtered_mem0_results and mem0_results:
-                top_result = max(mem0_results, key=lambda x: x.get('score', 0))
-                if top_result.get('score', 0) >= 0.3:
-                    filtered_mem0_results = [top_result]
+            if not filtered_mem0_results and top_result is not None and top_score >= 0.3:
+                filtered_mem0_results = [top_result]
             
             if not filtered_mem0_results and not db_memories:
                 if time_entities:
                     return f"🔍 I couldn't find any relevant memories for that time period. Try a different time range or add some memories first!"
                 return "🔍 I couldn't find any relevant memories. Try adding some memories first!"
             
-            response = f"🔍 Here's what I found for '{query}':\n\n"
-            
             if filtered_mem0_results:
-                # Find matching DB records for enriched formatting
-                for i, result in enumerate(filtered_mem0_results[:3], 1):
-                    memory_text = result.get('memory', result.get('content', str(result)))
-                    metadata = result.get('metadata', {})
-                    
-                    # Add content type emoji and source info
-                    content_type = metadata.get('content_type', 'text')
-                    source = metadata.get('source', '')
-                    
-                    if content_type == 'image':
-                        type_emoji = '📸'
-                    elif content_type == 'audio':
-                        type_emoji = '🎤'
-                    else:
-                        type_emoji = '💬'
-                    
-                    # Find matching DB record for date info
-                    memory_id = result.get('id', result.get('memory_id'))
-                    db_match = None
-                    for db_mem in db_memories:
-                        if db_mem['mem0_memory_id'] == memory_id:
-                            db_match = db_mem
-                            break
-                    
-                    # Add date/source context
-                    if db_match and db_match.get('interaction_date'):
-                        date_str = db_match['interaction_date'][:10]  # YYYY-MM-DD
-                        source_info = f" ({date_str})"
-                    elif source:
-                        source_info = f" (from {source})"
-                    else:
-                        source_info = ""
-                    
-                    # Add tags if available for extra context
-                    tags = []
-                    if 'insights' in metadata and 'tags' in metadata['insights']:
-                        tags = metadata['insights']['tags']
-                    elif 'tags' in metadata:
-                        tags = metadata['tags']
-                    
-                    # Format tags nicely
-                    tag_info = ""
-                    if tags:
-                        relevant_tags = [tag for tag in tags[:3] if tag not in ['general', 'text', 'voice', 'visual']]  # Skip generic tags
-                        if relevant_tags:
-                            tag_info = f"\n   🏷️ Tags: {', '.join(relevant_tags)}"
-                    
-                    # Don't truncate - show full memory text
-                    # Just clean up any extra whitespace
-                    memory_text = memory_text.strip()
-                    
-                    response += f"{i}. {type_emoji} {memory_text}{source_info}{tag_info}\n\n"
-            
-            if len(filtered_mem0_results) == 0 and db_memories:
-                # Fallback to filtered database memories
-                if time_entities:
-                    response_prefix = "🔍 Here are your memories from that time period:\n\n"
-                else:
-                    response_prefix = "🔍 Here are some recent memories:\n\n"
-                response = response_prefix
-                for i, memory in enumerate(db_memories[:5], 1):  # Show more results when relying on DB only
-                    content = memory['memory_content']
-                    if len(content) > 100:
-                        content = content[:100] + "..."
-                    response += f"{i}. {content}\n"
+                # Fetch just the DB records behind the hits, for enriched formatting;
+                # rows without a Mem0 id can't match and would shadow id-less results
+                hit_ids = [
+                    memory_id for memory_id in (
+                        result.get('id', result.get('memory_id')) for result in filtered_mem0_results[:3]
+                    ) if memory_id
+                ]
+                db_by_mem0_id = {}
+                for db_mem in db.get_memories_by_mem0_ids(user_id, hit_ids, time_entities, user_timezone):
+                    db_by_mem0_id.setdefault(db_mem['mem0_memory_id'], db_mem)
+                
+                return f"🔍 Here's what I found for '{query}':\n\n" + "".join(
+                    _format_mem0_results(filtered_mem0_results, db_by_mem0_id)
+                )
             
-            return response
+            # Fallback to filtered database memories
+            if time_entities:
+                response_prefix = "🔍 Here are your memories from that time period:\n\n"
+            else:
+                response_prefix = "🔍 Here are some recent memories:\n\n"
+            return response_prefix + "".join(
+                f"{i}. {_truncate(memory['memory_content'], 100)}\n"
+                for i, memory in enumerate(db_memories, 1)  # Show more results when relying on DB only
+            )
             
-        except Exception as e:
-            print(f"Error searching memories: {e}")
-            return "❌ Sorry, I had trouble searching your memories. Please try again."
+        except Exception:
+            logger.exception("Error searching memories")
+            return _SEARCH_ERROR_REPLY
     
     def send_whatsapp_message(self, to_number: str, message: str) -> bool:
-        """Send WhatsApp message via Twilio"""
-        try:
-            message = self.client.messages.create(
-                body=message,
-                from_=self.whatsapp_number,
-                to=to_number
-            )
-            return True
-        except Exception as e:
-            print(f"Error sending WhatsApp message: {e}")
-            return False
+        """Send WhatsApp message via Twilio, retrying rate limits and server errors"""
+        for attempt in range(WHATSAPP_SEND_ATTEMPTS):
+            try:
+                self.client.messages.create(
+                    body=message,
+                    from_=self.whatsapp_number,
+                    to=to_number
+                )
+                return True
+            except TwilioRestException as e:
+                if e.status not in _RETRYABLE_SEND_STATUS or attempt == WHATSAPP_SEND_ATTEMPTS - 1:
+                    logger.error("Error sending WhatsApp message: %s", e)
+                    return False
+                time.sleep(2 ** attempt)
+            except Exception:
+                logger.exception("Error sending WhatsApp message")
+                return False
+        return False
+    
+    def queue_whatsapp_message(self, to_number: str, message: str) -> Future:
+        """Send a WhatsApp message from a background thread; returns a Future of the result"""
+        return _send_pool.submit(self.send_whatsapp_message, to_number, message)
     
     def create_twiml_response(self, message: str) -> str:
         """Create TwiML response"""
-        response = MessagingResponse()
-        response.message(message)
-        return str(response)
+        return _twiml_for(message)
+
+
+@lru_cache(maxsize=64)
+def _twiml_for(message: str) -> str:
+    """TwiML for a reply; canned acks and errors repeat, so the XML is memoized"""
+    response = MessagingResponse()
+    response.message(message)
+    return str(response)
 
 
 # Global handler instance
@@ -1,81 +1,142 @@
+import random
 import re
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import List, Dict, Optional
 import pytz
 
+# Query intents, checked in order; the first intent with a matching pattern wins
+_INTENT_PATTERNS = {
+    'search': [
+        r'what.*did.*i.*', r'show.*me.*', r'find.*', r'where.*', r'when.*',
+        r'remind.*me.*about.*', r'do.*you.*remember.*', r'.*\?'
+    ],
+    'list': [r'/list', r'list.*all', r'show.*all.*memories', r'my.*memories'],
+    'delete': [r'delete.*', r'remove.*', r'forget.*'],
+    'help': [r'help', r'how.*', r'what.*can.*you.*do']
+}
+
+# All intents in one regex, one named group each. Every group is anchored at the
+# start with a lazy skip, so an earlier intent matching anywhere in the text still
+# beats a later one, exactly as when each pattern was searched in turn.
+_INTENT_RE = re.compile('|'.join(
+    f"(?P<{name}>(?s:.)*?(?:{'|'.join(patterns)}))"
+    for name, patterns in _INTENT_PATTERNS.items()
+))
+
+# Time reference patterns; numeric ones capture their amount in group 1
+_TIME_PATTERNS = [
+    (entity_type, re.compile(pattern))
+    for entity_type, pattern in {
+        'today': r'\btoday\b',
+        'yesterday': r'\byesterday\b',
+        'this_week': r'\bthis week\b',
+        'last_week': r'\blast week\b',
+        'this_month': r'\bthis month\b',
+        'last_month': r'\blast month\b',
+        'hours_ago': r'(\d+)\s+hours?\s+ago',
+        'days_ago': r'(\d+)\s+days?\s+ago',
+        'weeks_ago': r'(\d+)\s+weeks?\s+ago',
+        'months_ago': r'(\d+)\s+months?\s+ago',
+        'last_hours': r'\blast\s+(\d+)\s+hours?\b'
+    }.items()
+]
+
+# Every time pattern contains one of these words, so texts without any can't match
+_TIME_HINT_RE = re.compile(r'today|yesterday|week|month|ago|last')
+
+_NONWORD_RE = re.compile(r'[^\w\s]')
+
+# Common words left out of extracted keywords
+_STOP_WORDS = frozenset({
+    'i', 'me', 'my', 'you', 'your', 'the', 'a', 'an', 'and', 'or', 'but',
+    'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was',
+    'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did',
+    'will', 'would', 'could', 'should', 'can', 'may', 'might', 'what', 'when',
+    'where', 'who', 'how', 'why', 'this', 'that', 'these', 'those'
+})
+
+# Display icon per memory message type
+_DISPLAY_ICONS = {'text': '📝', 'image': '📸', 'audio': '🎤'}
+
+# (message type, has tags) -> display format, built once from the icons
+_DISPLAY_TEMPLATES = {
+    (message_type, with_tags): f"{icon} {{content}} ({{date}})" + (" 🏷️ {tags}" if with_tags else "")
+    for message_type, icon in _DISPLAY_ICONS.items()
+    for with_tags in (False, True)
+}
+
+_TRUNCATED_SUFFIX = "... [truncated]"
+
+# Message type -> (base seconds, bytes per extra second; 0 when size doesn't matter)
+_PROCESSING_ESTIMATES = {
+    'text': (1, 0),
+    'image': (3, 1_000_000),  # Base 3s + 1s per MB
+    'audio': (5, 500_000),    # Base 5s + 1s per 500KB (transcription)
+}
+
+# Fields every Twilio webhook must carry
+_REQUIRED_WEBHOOK_FIELDS = frozenset({'From', 'To', 'MessageSid'})
+
+# New-user greetings: (opening, opening with the user's name, rest of the message)
+_GREETINGS = (
+    ("👋 Hi there!", "👋 Hi {}!", " I'm your WhatsApp Memory Assistant. I can help you remember things by storing your messages, photos, and voice notes!"),
+    ("🌟 Welcome!", "🌟 Welcome {}!", " I'm here to be your digital memory. Send me anything you want to remember - text, images, or voice messages!"),
+    ("💡 Hello!", "💡 Hello {}!", " I'm your personal memory keeper. I'll store and help you recall your messages, photos, and voice notes. Try asking me to 'list' your memories!"),
+)
+
+# Separators dropped from phone numbers, in one translate() pass
+_PHONE_STRIP_TABLE = str.maketrans('', '', ' -()')
+
 
 def clean_phone_number(phone_number: str) -> str:
     """Clean and normalize phone number"""
-    # Remove whatsapp: prefix and any spaces/dashes
-    cleaned = phone_number.replace('whatsapp:', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+    # Remove whatsapp: prefix and any spaces/dashes/parentheses
+    cleaned = phone_number.removeprefix('whatsapp:').translate(_PHONE_STRIP_TABLE)
     
     # Ensure it starts with +
-    if not cleaned.startswith('+'):
-        cleaned = '+' + cleaned
-    
-    return cleaned
+    return cleaned if cleaned.startswith('+') else '+' + cleaned
+
 
+@dataclass(slots=True, frozen=True)
+class QueryIntent:
+    """Intent and entities extracted from a user query"""
+    intent: str
+    time_entities: List[Dict[str, str]]
+    keywords: List[str]
+    original_text: str
 
-def extract_query_intent(text: str) -> Dict[str, any]:
+
+def extract_query_intent(text: str) -> QueryIntent:
     """Extract intent and entities from user query"""
     text_lower = text.lower().strip()
     
-    intent_patterns = {
-        'search': [
-            r'what.*did.*i.*', r'show.*me.*', r'find.*', r'where.*', r'when.*',
-            r'remind.*me.*about.*', r'do.*you.*remember.*', r'.*\?'
-        ],
-        'list': [r'/list', r'list.*all', r'show.*all.*memories', r'my.*memories'],
-        'delete': [r'delete.*', r'remove.*', r'forget.*'],
-        'help': [r'help', r'how.*', r'what.*can.*you.*do']
-    }
-    
-    # Detect intent
-    intent = 'message'  # default
-    for intent_name, patterns in intent_patterns.items():
-        for pattern in patterns:
-            if re.search(pattern, text_lower):
-                intent = intent_name
-                break
-        if intent != 'message':
-            break
-    
-    # Extract time references
-    time_entities = extract_time_entities(text)
-    
-    # Extract keywords
-    keywords = extract_keywords(text)
+    # Detect intent; any question mark already means search (the first intent),
+    # so those skip the regex
+    if '?' in text_lower:
+        intent = 'search'
+    else:
+        match = _INTENT_RE.match(text_lower)
+        intent = match.lastgroup if match else 'message'
     
-    return {
-        'intent': intent,
-        'time_entities': time_entities,
-        'keywords': keywords,
-        'original_text': text
-    }
+    return QueryIntent(
+        intent=intent,
+        time_entities=extract_time_entities(text),
+        keywords=extract_keywords(text),
+        original_text=text
+    )
 
 
 def extract_time_entities(text: str) -> List[Dict[str, str]]:
     """Extract time-related entities from text"""
     text_lower = text.lower()
-    time_entities = []
+    if not _TIME_HINT_RE.search(text_lower):
+        return []
     
-    time_patterns = {
-        'today': r'\btoday\b',
-        'yesterday': r'\byesterday\b',
-        'this_week': r'\bthis week\b',
-        'last_week': r'\blast week\b',
-        'this_month': r'\bthis month\b',
-        'last_month': r'\blast month\b',
-        'hours_ago': r'(\d+)\s+hours?\s+ago',
-        'days_ago': r'(\d+)\s+days?\s+ago',
-        'weeks_ago': r'(\d+)\s+weeks?\s+ago',
-        'months_ago': r'(\d+)\s+months?\s+ago',
-        'last_hours': r'\blast\s+(\d+)\s+hours?\b'
-    }
-    
-    for entity_type, pattern in time_patterns.items():
-        matches = re.finditer(pattern, text_lower)
-        for match in matches:
+    time_entities = []
+    for entity_type, pattern in _TIME_PATTERNS:
+        for match in pattern.finditer(text_lower):
             time_entities.append({
                 'type': entity_type,
                 'text': match.group(0),
@@ -87,79 +148,90 @@ def extract_time_entities(text: str) -> List[Dict[str, str]]:
 
 def extract_keywords(text: str) -> List[str]:
     """Extract relevant keywords from text"""
-    # Remove common words and extract meaningful terms
-    stop_words = {
-        'i', 'me', 'my', 'you', 'your', 'the', 'a', 'an', 'and', 'or', 'but',
-        'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was',
-        'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did',
-        'will', 'would', 'could', 'should', 'can', 'may', 'might', 'what', 'when',
-        'where', 'who', 'how', 'why', 'this', 'that', 'these', 'those'
-    }
-    
-    # Clean and split text
-    cleaned = re.sub(r'[^\w\s]', ' ', text.lower())
-    words = [word.strip() for word in cleaned.split() if len(word) > 2]
-    
-    # Filter out stop words
-    keywords = [word for word in words if word not in stop_words]
+    # Clean and split text, keeping meaningful terms that aren't common words
+    words = _NONWORD_RE.sub(' ', text.lower()).split()
+    keywords = [word for word in words if len(word) > 2 and word not in _STOP_WORDS]
     
     return keywords[:10]  # Limit to top 10 keywords
 
 
-def get_timezone_aware_date(date_string: str, user_timezone: str = 'UTC') -> datetime:
-    """Convert date string to timezone-aware datetime"""
-    try:
-        # Parse the date string (assuming ISO format)
-        dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
-        
-        # Convert to user timezone
-        user_tz = pytz.timezone(user_timezone)
-        return dt.astimezone(user_tz)
-    except:
-        return datetime.now(pytz.timezone(user_timezone))
+@lru_cache(maxsize=128)
+def _tz(name: str):
+    """Cached pytz timezone lookup"""
+    return pytz.timezone(name)
+
+
+# Shortest string fromisoformat accepts (YYYYWww, an ISO week date)
+_MIN_ISO_LENGTH = 7
+
+
+@lru_cache(maxsize=4096)
+def _iso_parse(date_string: str) -> datetime:
+    """Parse an ISO timestamp, accepting a trailing Z; the same values recur across calls"""
+    if date_string.endswith('Z'):
+        return datetime.fromisoformat(date_string[:-1] + '+00:00')
+    return datetime.fromisoformat(date_string)
+
+
+def _localize(date_string, user_tz) -> datetime:
+    """Date string or datetime converted to user_tz; now if it can't be parsed"""
+    if isinstance(date_string, datetime):
+        dt = date_string
+    elif isinstance(date_string, str) and len(date_string) >= _MIN_ISO_LENGTH:
+        try:
+            dt = _iso_parse(date_string)
+        except ValueError:
+            return datetime.now(user_tz)
+    else:
+        return datetime.now(user_tz)
+    
+    # Convert to user timezone
+    return dt.astimezone(user_tz)
+
+
+def get_timezone_aware_date(date_string, user_timezone: str = 'UTC') -> datetime:
+    """Convert date string (or datetime from the DB layer) to timezone-aware datetime"""
+    return _localize(date_string, _tz(user_timezone))
+
+
+def _day_start(now: datetime) -> datetime:
+    """Midnight at the start of now's day"""
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _week_start(now: datetime) -> datetime:
+    """Midnight at the start of now's week (Monday)"""
+    return _day_start(now) - timedelta(days=now.weekday())
+
+
+def _day_end(now: datetime) -> datetime:
+    """Last microsecond of now's day"""
+    return now.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+
+# Time entity type -> (now, entity) -> (start, end) of the range it covers
+_RANGE_BUILDERS = {
+    'today': lambda now, entity: (_day_start(now), _day_start(now) + timedelta(days=1)),
+    'yesterday': lambda now, entity: (_day_start(now) - timedelta(days=1), _day_start(now)),
+    'this_week': lambda now, entity: (_week_start(now), _week_start(now) + timedelta(days=7)),
+    'last_week': lambda now, entity: (_week_start(now) - timedelta(days=7), _week_start(now)),
+    'days_ago': lambda now, entity: (
+        _day_end(now) - timedelta(days=int(entity['value'])), _day_end(now)
+    ),
+    'hours_ago': lambda now, entity: (now - timedelta(hours=int(entity['value'])), now),
+    'last_hours': lambda now, entity: (now - timedelta(hours=int(entity['value'])), now),
+}
 
 
 def filter_by_time_range(items: List[Dict], time_entity: Dict, timezone: str = 'UTC') -> List[Dict]:
     """Filter items by time range based on extracted time entity"""
-    now = datetime.now(pytz.timezone(timezone))
-    
-    if time_entity['type'] == 'today':
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_date = start_date + timedelta(days=1)
-    elif time_entity['type'] == 'yesterday':
-        end_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_date = end_date - timedelta(days=1)
-    elif time_entity['type'] == 'this_week':
-        days_since_monday = now.weekday()
-        start_date = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-        end_date = start_date + timedelta(days=7)
-    elif time_entity['type'] == 'last_week':
-        days_since_monday = now.weekday()
-        this_week_start = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_since_monday)
-        start_date = this_week_start - timedelta(days=7)
-        end_date = this_week_start
-    elif time_entity['type'] == 'days_ago':
-        days = int(time_entity['value'])
-        end_date = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-        start_date = end_date - timedelta(days=days)
-    elif time_entity['type'] == 'hours_ago':
-        hours = int(time_entity['value'])
-        end_date = now
-        start_date = end_date - timedelta(hours=hours)
-    elif time_entity['type'] == 'last_hours':
-        hours = int(time_entity['value'])
-        end_date = now
-        start_date = end_date - timedelta(hours=hours)
-    else:
+    build_range = _RANGE_BUILDERS.get(time_entity['type'])
+    if build_range is None:
         return items  # No filtering
     
-    filtered_items = []
-    for item in items:
-        item_date = get_timezone_aware_date(item['created_at'], timezone)
-        if start_date <= item_date < end_date:
-            filtered_items.append(item)
-    
-    return filtered_items
+    user_tz = _tz(timezone)
+    start_date, end_date = build_range(datetime.now(user_tz), time_entity)
+    return [item for item in items if start_date <= _localize(item['created_at'], user_tz) < end_date]
 
 
 def format_memory_for_display(memory: Dict, include_metadata: bool = True) -> str:
@@ -172,45 +244,38 @@ def format_memory_for_display(memory: Dict, include_metadata: bool = True) -> st
     
     # Format date
     created_at = memory.get('created_at', '')
-    if created_at:
+    if isinstance(created_at, datetime):
+        date_str = created_at.strftime('%Y-%m-%d %H:%M')
+    elif isinstance(created_at, str) and len(created_at) >= _MIN_ISO_LENGTH:
         try:
-            date_obj = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            date_str = date_obj.strftime('%Y-%m-%d %H:%M')
-        except:
+            date_str = _iso_parse(created_at).strftime('%Y-%m-%d %H:%M')
+        except ValueError:
             date_str = created_at[:16]  # Fallback
+    elif created_at:
+        date_str = str(created_at)  # Too short to be an ISO date, or not a string
     else:
         date_str = 'Unknown date'
     
-    formatted = f"📝 {content} ({date_str})"
-    
+    # Message type indicator and tags (the DB layer already decodes them to a list)
+    # only come with metadata; each combination has its own template
     if include_metadata:
-        # Add tags if available
-        tags = memory.get('tags', [])
-        if isinstance(tags, str):
-            try:
-                import json
-                tags = json.loads(tags)
-            except:
-                tags = []
-        
-        if tags:
-            tag_str = ', '.join(tags[:3])  # Show max 3 tags
-            formatted += f" 🏷️ {tag_str}"
-        
-        # Add message type indicator
-        message_type = memory.get('message_type', '')
-        if message_type == 'image':
-            formatted = formatted.replace('📝', '📸')
-        elif message_type == 'audio':
-            formatted = formatted.replace('📝', '🎤')
+        message_type = memory.get('message_type')
+        tags = memory.get('tags')
+    else:
+        message_type, tags = 'text', None
     
-    return formatted
+    with_tags = bool(tags)
+    template = _DISPLAY_TEMPLATES.get((message_type, with_tags), _DISPLAY_TEMPLATES[('text', with_tags)])
+    return template.format(
+        content=content,
+        date=date_str,
+        tags=', '.join(tags[:3]) if with_tags else ''  # Show max 3 tags
+    )
 
 
 def validate_webhook_data(data: Dict) -> bool:
     """Validate Twilio webhook data"""
-    required_fields = ['From', 'To', 'MessageSid']
-    return all(field in data for field in required_fields)
+    return _REQUIRED_WEBHOOK_FIELDS.issubset(data)
 
 
 def sanitize_content(content: str, max_length: int = 10000) -> str:
@@ -218,38 +283,25 @@ def sanitize_content(content: str, max_length: int = 10000) -> str:
     if not content:
         return ""
     
-    # Remove potentially harmful content
+    # Remove potentially harmful content; strip() hands back the same string
+    # without copying when there's no surrounding whitespace
     content = content.strip()
     
     # Limit length
     if len(content) > max_length:
-        content = content[:max_length] + "... [truncated]"
+        return content[:max_length] + _TRUNCATED_SUFFIX
     
     return content
 
 
 def generate_response_greeting(user_name: str = None) -> str:
     """Generate friendly greeting for new users"""
-    greetings = [
-        "👋 Hi there! I'm your WhatsApp Memory Assistant. I can help you remember things by storing your messages, photos, and voice notes!",
-        "🌟 Welcome! I'm here to be your digital memory. Send me anything you want to remember - text, images, or voice messages!",
-        "💡 Hello! I'm your personal memory keeper. I'll store and help you recall your messages, photos, and voice notes. Try asking me to 'list' your memories!"
-    ]
-    
-    import random
-    greeting = random.choice(greetings)
-    
-    if user_name:
-        greeting = greeting.replace("Hi there!", f"Hi {user_name}!")
-        greeting = greeting.replace("Welcome!", f"Welcome {user_name}!")
-        greeting = greeting.replace("Hello!", f"Hello {user_name}!")
-    
-    return greeting
+    anonymous_opening, named_opening, rest = random.choice(_GREETINGS)
+    opening = named_opening.format(user_name) if user_name else anonymous_opening
+    return opening + rest
 
 
-def create_help_message() -> str:
-    """Create help message for users"""
-    return """🤖 WhatsApp Memory Assistant Help
+_HELP_MESSAGE = """🤖 WhatsApp Memory Assistant Help
 
 What I can do:
 📝 Remember your text messages
@@ -272,13 +324,12 @@ I understand time references like:
 Try me out! Send a message, photo, or voice note and I'll remember it for you! 🚀"""
 
 
+def create_help_message() -> str:
+    """Create help message for users"""
+    return _HELP_MESSAGE
+
+
 def estimate_processing_time(message_type: str, file_size: int = 0) -> int:
     """Estimate processing time in seconds"""
-    if message_type == 'text':
-        return 1
-    elif message_type == 'image':
-        return 3 + (file_size // 1000000)  # Base 3s + 1s per MB
-    elif message_type == 'audio':
-        return 5 + (file_size // 500000)   # Base 5s + 1s per 500KB (transcription)
-    else:
-        return 2
\ No newline at end of file
+    base, bytes_per_second = _PROCESSING_ESTIMATES.get(message_type, (2, 0))
+    return base + (file_size // bytes_per_second if bytes_per_second else 0)
@@ -10,6 +10,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from src.main import app
 from src.database import Database
+from src.models import Base
 from src.utils import clean_phone_number, extract_query_intent, format_memory_for_display
 
 client = TestClient(app)
@@ -33,6 +34,17 @@ class TestAPI:
         assert "services" in data
         assert "database" in data["services"]
     
+    def test_health_check_etag(self):
+        """Test health check returns 304 when the client's ETag still matches"""
+        response = client.get("/health")
+        etag = response.headers["ETag"]
+        
+        response = client.get("/health", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        
+        response = client.get("/health", headers={"If-None-Match": '"stale"'})
+        assert response.status_code == 200
+    
     def test_memories_list_endpoint(self):
         """Test memories list endpoint"""
         response = client.get("/memories/list")
@@ -72,14 +84,75 @@ class TestAPI:
         })
         # May fail due to Mem0 API key, but should return proper error structure
         assert response.status_code in [200, 500]
+    
+    def test_add_memories_batch_api(self):
+        """Test adding several memories in one request"""
+        response = client.post("/memories/batch", json={
+            "items": [
+                {"content": "Batch memory one", "user_id": "test_user_123"},
+                {"content": "Batch memory two", "user_id": "test_user_123"}
+            ]
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_count"] == 2
+        assert len(data["results"]) == 2
+    
+    def test_batch_memory_count_mismatch_retries_individually(self, monkeypatch):
+        """Test a batch reply without one result per text isn't paired by position"""
+        from types import SimpleNamespace
+        from src.memory_service import memory_service
+        
+        batch_reply = {"results": [{"id": "mem_only_one"}]}
+        monkeypatch.setattr(memory_service, "memory", SimpleNamespace(add=lambda **kwargs: batch_reply))
+        monkeypatch.setattr(memory_service, "create_text_memory", lambda text, user_id, metadata=None: f"mem_{text}")
+        
+        ids = memory_service.create_text_memories_batch(["a", "b"], "test_user_123")
+        assert ids == ["mem_a", "mem_b"]
+    
+    def test_rolling_time_filter_includes_just_created_memory(self):
+        """Test a last-hour search right after saving a memory covers that memory"""
+        from datetime import datetime, timezone
+        from src.memory_service import memory_service
+        
+        entities = [{"type": "last_hours", "value": "1"}]
+        memory_service._build_time_filters(entities, "UTC")  # Warm any cached windows
+        created_at = datetime.now(timezone.utc)
+        
+        window = memory_service._build_time_filters(entities, "UTC")["created_at"]
+        assert datetime.fromisoformat(window["gte"]) <= created_at <= datetime.fromisoformat(window["lte"])
+    
+    def test_search_requests_get_short_timeout(self):
+        """Test Mem0 search calls are capped at the search timeout while other calls keep the default"""
+        import httpx
+        from src.memory_service import MEM0_SEARCH_TIMEOUT, _cap_search_timeout
+        
+        search = httpx.Request("POST", "https://api.mem0.ai/v3/memories/search/")
+        add = httpx.Request("POST", "https://api.mem0.ai/v1/memories/")
+        default_timeout = add.extensions.get("timeout")
+        _cap_search_timeout(search)
+        _cap_search_timeout(add)
+        assert search.extensions["timeout"]["read"] == MEM0_SEARCH_TIMEOUT
+        assert add.extensions.get("timeout") == default_timeout
+
+
+@pytest.fixture(scope="class")
+def shared_db():
+    """One in-memory database per test class, so the schema is only created once"""
+    return Database("sqlite:///:memory:")
 
 
 class TestDatabase:
     """Test database operations"""
     
-    def setup_method(self):
-        """Setup test database"""
-        self.test_db = Database("sqlite:///:memory:")  # Use in-memory DB for tests
+    @pytest.fixture(autouse=True)
+    def _empty_db(self, shared_db):
+        """Give each test an empty database"""
+        with shared_db.engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+        shared_db.clear_caches()
+        self.test_db = shared_db
     
     def test_create_user(self):
         """Test user creation"""
@@ -90,6 +163,23 @@ class TestDatabase:
         user_id2 = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
         assert user_id == user_id2
     
+    def test_user_lookups_are_cached(self):
+        """Test repeat user lookups are served from the in-process cache"""
+        user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
+        user = self.test_db.get_user_by_id(user_id)
+        user["timezone"] = "Asia/Kolkata"  # Mutating a result must not leak into the cache
+        
+        queries = []
+        from sqlalchemy import event
+        record = lambda *args: queries.append(args[2])
+        event.listen(self.test_db.engine, "before_cursor_execute", record)
+        try:
+            assert self.test_db.create_user("+1234567890", "whatsapp:+1234567890") == user_id
+            assert self.test_db.get_user_by_id(user_id)["timezone"] == "UTC"
+        finally:
+            event.remove(self.test_db.engine, "before_cursor_execute", record)
+        assert queries == []
+    
     def test_get_user_by_phone(self):
         """Test getting user by phone"""
         # Create user first
@@ -123,6 +213,130 @@ class TestDatabase:
         )
         assert interaction_id == interaction_id2
     
+    def test_create_interaction_with_created_at(self):
+        """Test backdated interaction creation"""
+        from datetime import datetime
+        
+        user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
+        created_at = datetime(2023, 12, 1, 10, 30)
+        
+        self.test_db.create_interaction(
+            user_id=user_id,
+            twilio_message_sid="test_sid_backdated",
+            message_type="text",
+            content="Old message",
+            created_at=created_at
+        )
+        
+        interaction = self.test_db.get_interaction_by_sid("test_sid_backdated")
+        assert interaction["created_at"] == created_at
+
+    def test_create_with_shared_session(self):
+        """Test helpers writing through a caller-owned session"""
+        with self.test_db.get_session() as session:
+            user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890", session=session)
+            interaction_id = self.test_db.create_interaction(
+                user_id=user_id,
+                twilio_message_sid="test_sid_shared",
+                message_type="text",
+                content="Shared session message",
+                session=session
+            )
+            self.test_db.create_memory(
+                user_id=user_id,
+                interaction_id=interaction_id,
+                mem0_memory_id="mem0_shared",
+                memory_content="Shared session message",
+                tags=["test", "shared"],
+                session=session
+            )
+
+        memories = self.test_db.get_memories_for_user(user_id)
+        assert len(memories) == 1
+        assert memories[0]["interaction_id"] == interaction_id
+        assert memories[0]["tags"] == ["test", "shared"]
+
+    def test_recent_interactions_user_filter_before_limit(self):
+        """Test per-user recent interactions aren't cut short by other users' rows"""
+        from datetime import datetime, timedelta
+
+        user_a = self.test_db.create_user("+1111111111", "whatsapp:+1111111111")
+        user_b = self.test_db.create_user("+2222222222", "whatsapp:+2222222222")
+        base_time = datetime(2023, 12, 1, 10, 30)
+
+        for i in range(3):
+            self.test_db.create_interaction(
+                user_id=user_a, twilio_message_sid=f"test_sid_a_{i}", message_type="text",
+                content=f"A {i}", created_at=base_time - timedelta(days=1, minutes=i)
+            )
+            # User B's rows are newer and would fill the LIMIT if it ran before the filter
+            self.test_db.create_interaction(
+                user_id=user_b, twilio_message_sid=f"test_sid_b_{i}", message_type="text",
+                content=f"B {i}", created_at=base_time - timedelta(minutes=i)
+            )
+
+        interactions = self.test_db.get_recent_interactions(user_id=user_a, limit=2)
+        assert [i["content"] for i in interactions] == ["A 0", "A 1"]
+        assert all(i["phone_number"] == "+1111111111" for i in interactions)
+
+    def test_get_memories_by_mem0_ids(self):
+        """Test fetching only the memories matching given Mem0 ids"""
+        user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
+        for i in range(3):
+            interaction_id = self.test_db.create_interaction(
+                user_id=user_id,
+                twilio_message_sid=f"test_sid_mem0_{i}",
+                message_type="text",
+                content=f"Message {i}"
+            )
+            self.test_db.create_memory(
+                user_id=user_id,
+                interaction_id=interaction_id,
+                mem0_memory_id=f"mem0_{i}",
+                memory_content=f"Message {i}"
+            )
+        
+        memories = self.test_db.get_memories_by_mem0_ids(user_id, ["mem0_0", "mem0_2", "mem0_missing"])
+        assert sorted(m["mem0_memory_id"] for m in memories) == ["mem0_0", "mem0_2"]
+        assert self.test_db.get_memories_by_mem0_ids(user_id, []) == []
+    
+    def test_iter_memories_for_user(self):
+        """Test streaming all of a user's memories in small batches"""
+        user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
+        for i in range(5):
+            interaction_id = self.test_db.create_interaction(
+                user_id=user_id,
+                twilio_message_sid=f"test_sid_iter_{i}",
+                message_type="text",
+                content=f"Message {i}"
+            )
+            self.test_db.create_memory(
+                user_id=user_id,
+                interaction_id=interaction_id,
+                mem0_memory_id=f"mem0_{i}",
+                memory_content=f"Message {i}"
+            )
+        
+        memories = list(self.test_db.iter_memories_for_user(user_id, batch_size=2))
+        assert sorted(m["memory_content"] for m in memories) == [f"Message {i}" for i in range(5)]
+    
+    def test_check_media_exists(self):
+        """Test media hash lookup for unknown and stored hashes"""
+        user_id = self.test_db.create_user("+1234567890", "whatsapp:+1234567890")
+        interaction_id = self.test_db.create_interaction(
+            user_id=user_id,
+            twilio_message_sid="test_sid_media",
+            message_type="image"
+        )
+        assert self.test_db.check_media_exists("test_hash") is None
+
+        self.test_db.update_interaction(
+            interaction_id,
+            media_file_path="./media/images/test_hash.jpg",
+            media_content_hash="test_hash"
+        )
+        assert self.test_db.check_media_exists("test_hash") == "./media/images/test_hash.jpg"
+
     def test_analytics_summary(self):
         """Test analytics summary"""
         # Create some test data
@@ -144,31 +358,41 @@ class TestDatabase:
 class TestUtils:
     """Test utility functions"""
     
-    def test_clean_phone_number(self):
+    @pytest.mark.parametrize("raw, cleaned", [
+        ("whatsapp:+1234567890", "+1234567890"),
+        ("+1-234-567-890", "+1234567890"),
+        ("(123) 456-7890", "+1234567890"),
+        ("1234567890", "+1234567890"),
+    ])
+    def test_clean_phone_number(self, raw, cleaned):
         """Test phone number cleaning"""
-        assert clean_phone_number("whatsapp:+1234567890") == "+1234567890"
-        assert clean_phone_number("+1-234-567-890") == "+12345678890"
-        assert clean_phone_number("1234567890") == "+1234567890"
+        assert clean_phone_number(raw) == cleaned
+    
+    def test_clean_phone_number_perf(self, request):
+        """Benchmark phone number cleaning (needs pytest-benchmark)"""
+        pytest.importorskip("pytest_benchmark")
+        benchmark = request.getfixturevalue("benchmark")
+        assert benchmark(clean_phone_number, "whatsapp:+1-234-567-8901") == "+12345678901"
     
     def test_extract_query_intent(self):
         """Test query intent extraction"""
         # Search queries
         result = extract_query_intent("What did I say about dinner?")
-        assert result["intent"] == "search"
+        assert result.intent == "search"
         
         result = extract_query_intent("Show me my photos")
-        assert result["intent"] == "search"
+        assert result.intent == "search"
         
         # List commands
         result = extract_query_intent("/list")
-        assert result["intent"] == "list"
+        assert result.intent == "list"
         
         result = extract_query_intent("list all my memories")
-        assert result["intent"] == "list"
+        assert result.intent == "list"
         
         # Regular messages
         result = extract_query_intent("I had pizza for lunch")
-        assert result["intent"] == "message"
+        assert result.intent == "message"
     
     def test_format_memory_for_display(self):
         """Test memory formatting"""
@@ -187,6 +411,16 @@ class TestUtils:
         memory["message_type"] = "image"
         formatted = format_memory_for_display(memory)
         assert "📸" in formatted
+        
+        # DB layer returns datetimes rather than ISO strings
+        from datetime import datetime
+        memory["created_at"] = datetime(2023, 12, 1, 10, 30)
+        formatted = format_memory_for_display(memory)
+        assert "2023-12-01 10:30" in formatted
+        
+        # Missing dates (JSON null) fall back instead of raising
+        memory["created_at"] = None
+        assert "(Unknown date)" in format_memory_for_display(memory)
 
 
 class TestWebhookProcessing:
@@ -206,6 +440,29 @@ class TestWebhookProcessing:
         # Should return TwiML response
         assert response.status_code == 200
         assert "Content-Type" in response.headers
+    
+    def test_media_webhook_is_acknowledged_before_processing(self, monkeypatch):
+        """Test media messages are queued and finished after the TwiML ack"""
+        import uuid
+        from src.twilio_handler import twilio_handler
+        
+        queued = []
+        monkeypatch.setattr(twilio_handler, "process_queued_media", lambda *args: queued.append(args))
+        
+        response = client.post("/webhook", data={
+            "From": "whatsapp:+1234567890",
+            "To": "whatsapp:+14155238886",
+            "MessageSid": f"test_media_{uuid.uuid4().hex}",
+            "Body": "",
+            "NumMedia": "1",
+            "MediaUrl0": "https://api.twilio.com/Media/ME1",
+            "MediaContentType0": "image/jpeg"
+        })
+        
+        assert response.status_code == 200
+        assert "processing" in response.text
+        assert len(queued) == 1
+        assert queued[0][2] == "image"
 
 
 class TestMediaDeduplication:
@@ -226,6 +483,151 @@ class TestMediaDeduplication:
         
         assert hash1 == hash2  # Same content = same hash
         assert hash1 != hash3  # Different content = different hash
+    
+    def test_known_etag_skips_download(self, tmp_path):
+        """Test media with an already-seen ETag is served from disk"""
+        from types import SimpleNamespace
+        from src.media_processor import MediaProcessor
+        
+        processor = MediaProcessor(media_dir=str(tmp_path))
+        downloads = []
+        
+        class FakeResponse:
+            def __enter__(self):
+                return self
+            
+            def __exit__(self, *exc):
+                return False
+            
+            def raise_for_status(self):
+                pass
+            
+            def iter_content(self, chunk_size):
+                yield b"forwarded image bytes"
+        
+        def fake_get(url, **kwargs):
+            downloads.append(url)
+            return FakeResponse()
+        
+        processor.session.get = fake_get
+        headers = {"ETag": '"0cc175b9c0f1b6a831c399e269772661"', "Content-Length": str(len(b"forwarded image bytes"))}
+        processor.session.head = lambda url, **kwargs: SimpleNamespace(ok=True, headers=headers)
+        
+        first = processor.process_media("https://api.twilio.com/Media/ME1", "image", ("sid", "token"), "image/jpeg")
+        second = processor.process_media("https://api.twilio.com/Media/ME2", "image", ("sid", "token"), "image/jpeg")
+        
+        assert downloads == ["https://api.twilio.com/Media/ME1"]
+        assert second["file_path"] == first["file_path"]
+        assert second["content_hash"] == first["content_hash"]
+        
+        # Weak or version-style ETags, or a size mismatch, never skip the download
+        for etag, length in (('W/"0cc175b9c0f1b6a831c399e269772661"', headers["Content-Length"]),
+                             ('"3"', headers["Content-Length"]),
+                             (headers["ETag"], "999")):
+            headers = {"ETag": etag, "Content-Length": length}
+            processor.process_media("https://api.twilio.com/Media/ME3", "image", ("sid", "token"), "image/jpeg")
+        assert downloads.count("https://api.twilio.com/Media/ME3") == 3
+    
+    def test_transcript_reused_for_same_content(self, tmp_path):
+        """Test identical audio content is transcribed only once"""
+        from types import SimpleNamespace
+        from src.media_processor import MediaProcessor
+        
+        processor = MediaProcessor(media_dir=str(tmp_path))
+        calls = []
+        
+        def fake_convert(file, model_id):
+            calls.append(model_id)
+            return SimpleNamespace(text=" hello there ")
+        
+        processor.elevenlabs_client = SimpleNamespace(speech_to_text=SimpleNamespace(convert=fake_convert))
+        audio_path = tmp_path / "audio" / "clip.ogg"
+        audio_path.write_bytes(b"voice note")
+        
+        first = processor.transcribe_by_hash("abc", str(audio_path))
+        processor._transcripts.clear()
+        second = processor.transcribe_by_hash("abc", str(audio_path))
+        
+        assert first == second == "hello there"
+        assert len(calls) == 1
+        assert (tmp_path / "transcripts" / "abc.txt").read_text() == "hello there"
+
+
+class TestLLMService:
+    """Test LLM service caching"""
+    
+    def test_image_result_cache(self, tmp_path):
+        """Test repeated images are answered from the cache"""
+        from types import SimpleNamespace
+        from src.llm_service import LLMService
+        
+        calls = []
+        
+        def create(**kwargs):
+            calls.append(kwargs)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="A cat on a sofa"))])
+        
+        service = LLMService()
+        service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        
+        image_a = tmp_path / "a.jpg"
+        image_a.write_bytes(b"same image bytes")
+        image_b = tmp_path / "b.jpg"
+        image_b.write_bytes(b"same image bytes")
+        
+        assert service.analyze_image(str(image_a)) == "A cat on a sofa"
+        assert service.analyze_image(str(image_b)) == "A cat on a sofa"
+        assert len(calls) == 1  # Same content, different path = cache hit
+        
+        image_b.write_bytes(b"different image bytes")
+        service.analyze_image(str(image_b))
+        assert len(calls) == 2
+
+    
+    def test_streamed_insights_stop_at_closing_brace(self):
+        """Test insight streaming stops reading once the JSON object closes"""
+        from types import SimpleNamespace
+        from src.llm_service import LLMService
+        
+        chunks = ['{"tags": ["food"], ', '"category": "food", "sentiment": "positive"}', 'never read']
+        consumed = []
+        
+        def stream():
+            for content in chunks:
+                consumed.append(content)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+        
+        service = LLMService()
+        service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: stream()
+        )))
+        
+        insights = service.analyze_all(text="Pizza night with friends")
+        assert insights == {"tags": ["food"], "category": "food", "sentiment": "positive"}
+        assert "never read" not in consumed
+    
+    def test_exhausted_rate_limit_skips_non_streaming_retry(self, monkeypatch):
+        """Test a rate limit that used up its retries returns the fallback without a second round"""
+        from types import SimpleNamespace
+        from src import llm_service
+        
+        class RateLimited(Exception):
+            status_code = 429
+            response = None
+        
+        calls = []
+        
+        def create(**kwargs):
+            calls.append(kwargs.get("stream", False))
+            raise RateLimited("rate limited")
+        
+        monkeypatch.setattr(llm_service.time, "sleep", lambda seconds: None)
+        service = llm_service.LLMService()
+        service.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        
+        insights = service.analyze_all(text="Pizza night with friends")
+        assert insights == {"tags": [], "category": "general", "sentiment": "neutral"}
+        assert calls == [True] * llm_service.LLM_MAX_ATTEMPTS
 
 
 class TestErrorHandling: